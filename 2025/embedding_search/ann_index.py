@@ -0,0 +1,205 @@
+# ann_index.py
+# An approximate nearest-neighbour index for the embedding search, for libraries of book chunks too large to
+# compare every query with every vector (see embedding_store.py for the exact search).
+# It is an inverted file (IVF) index on NumPy, CPU only: k-means splits the normalized vectors into n_lists
+# clusters, and every vector is stored in the list of its nearest centroid. A query is compared with the
+# centroids first, and then only with the vectors of its nprobe nearest lists. nprobe is the recall/latency
+# knob: more lists find more of the true neighbours and take longer; nprobe = n_lists is an exact search.
+# New vectors can be added at any time. They go to the list of their nearest centroid; the centroids are not
+# trained again, so build a new index once the added books are very different from the ones it was trained on.
+# The index is saved as a directory: the vectors sorted by list in one .npy matrix that is memory mapped when it
+# is loaded, the centroids, and the ids in the order they were added.
+# Run this file to build an index from an embedding store directory.
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from embedding_store import BLOCK_ROWS, IDS_FILE, EmbeddingStore, normalize, save_array, save_json, top_k
+
+CENTROIDS_FILE = 'centroids.npy'
+VECTORS_FILE = 'vectors.npy'
+ROWS_FILE = 'rows.npy'
+OFFSETS_FILE = 'offsets.npy'
+SETTINGS_FILE = 'index.json'
+
+
+def nearest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the centroid with the highest cosine similarity for every vector, in blocks of BLOCK_ROWS."""
+    return np.concatenate([np.argmax(vectors[start:start + BLOCK_ROWS] @ centroids.T, axis=1)
+                           for start in range(0, len(vectors), BLOCK_ROWS)])
+
+
+def kmeans(vectors: np.ndarray, n_clusters: int, iterations: int = 10, seed: int = 42) -> np.ndarray:
+    """Spherical k-means: the centroids are normalized means of their vectors. An empty cluster is restarted
+    at a random vector."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        labels = nearest(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        empty = np.bincount(labels, minlength=n_clusters) == 0
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids
+
+
+class IVFIndex:
+    """Inverted file index of normalized vectors, searched by cosine similarity."""
+
+    def __init__(self, centroids: np.ndarray, nprobe: int = 8):
+        self.centroids = normalize(centroids)
+        self.nprobe = nprobe
+        self.ids = []
+        # Per list: the vectors, the position of every vector in self.ids, and the rows in use. The arrays
+        # have spare rows, so adding a few vectors does not copy the list
+        self.vectors = [np.empty((0, self.dim), dtype=np.float32) for _ in range(self.n_lists)]
+        self.rows = [np.empty(0, dtype=np.int64) for _ in range(self.n_lists)]
+        self.sizes = np.zeros(self.n_lists, dtype=np.int64)
+
+    @classmethod
+    def train(cls, vectors, n_lists: int, nprobe: int = 8, sample_size: int = 100000, iterations: int = 10,
+              seed: int = 42) -> 'IVFIndex':
+        """Finds the centroids with k-means on a random sample of the vectors. The index is still empty."""
+        rng = np.random.default_rng(seed)
+        if len(vectors) < n_lists:
+            raise ValueError(f'{len(vectors)} vectors cannot be split into {n_lists} lists')
+        sample = np.sort(rng.choice(len(vectors), min(sample_size, len(vectors)), replace=False))
+        return cls(kmeans(normalize(vectors[sample]), n_lists, iterations, seed), nprobe)
+
+    @classmethod
+    def from_store(cls, store: EmbeddingStore, n_lists: int, **kwargs) -> 'IVFIndex':
+        """Trains an index on the vectors of an embedding store and adds all of them."""
+        index = cls.train(store.embeddings, n_lists, **kwargs)
+        index.add(store.embeddings, store.ids)
+        return index
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> 'IVFIndex':
+        """Opens a saved index. With mmap the vectors are read from disk when their lists are searched."""
+        with open(os.path.join(directory, SETTINGS_FILE), encoding='utf-8') as f:
+            settings = json.load(f)
+        index = cls(np.load(os.path.join(directory, CENTROIDS_FILE)), settings['nprobe'])
+        with open(os.path.join(directory, IDS_FILE), encoding='utf-8') as f:
+            index.ids = json.load(f)
+        vectors = np.load(os.path.join(directory, VECTORS_FILE), mmap_mode='r' if mmap else None)
+        rows = np.load(os.path.join(directory, ROWS_FILE))
+        offsets = np.load(os.path.join(directory, OFFSETS_FILE))
+        for i in range(index.n_lists):
+            index.vectors[i] = vectors[offsets[i]:offsets[i + 1]]
+            index.rows[i] = rows[offsets[i]:offsets[i + 1]]
+        index.sizes = np.diff(offsets)
+        return index
+
+    def save(self, directory: str):
+        """Writes the index. The vectors of all lists are written one list after the other."""
+        os.makedirs(directory, exist_ok=True)
+        save_array(os.path.join(directory, CENTROIDS_FILE), self.centroids)
+        save_array(os.path.join(directory, VECTORS_FILE),
+                   np.concatenate([vectors[:size] for vectors, size in zip(self.vectors, self.sizes)]))
+        save_array(os.path.join(directory, ROWS_FILE),
+                   np.concatenate([rows[:size] for rows, size in zip(self.rows, self.sizes)]))
+        save_array(os.path.join(directory, OFFSETS_FILE), np.concatenate([[0], np.cumsum(self.sizes)]))
+        save_json(os.path.join(directory, IDS_FILE), self.ids)
+        save_json(os.path.join(directory, SETTINGS_FILE), {'nprobe': self.nprobe, 'n_lists': self.n_lists,
+                                                             'dim': self.dim, 'vectors': len(self)})
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def dim(self) -> int:
+        return self.centroids.shape[1]
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    def _append(self, i: int, vectors: np.ndarray, rows: np.ndarray):
+        size, needed = self.sizes[i], self.sizes[i] + len(vectors)
+        if needed > len(self.vectors[i]):  # grow by doubling; a loaded, memory-mapped list is copied here
+            capacity = max(needed, 2 * len(self.vectors[i]), 16)
+            grown = np.empty((capacity, self.dim), dtype=np.float32)
+            grown[:size] = self.vectors[i][:size]
+            self.vectors[i] = grown
+            grown_rows = np.empty(capacity, dtype=np.int64)
+            grown_rows[:size] = self.rows[i][:size]
+            self.rows[i] = grown_rows
+        self.vectors[i][size:needed] = vectors
+        self.rows[i][size:needed] = rows
+        self.sizes[i] = needed
+
+    def add(self, vectors, ids: list):
+        """Adds vectors with their ids, each to the list of its nearest centroid."""
+        ids = list(ids)
+        if len(ids) != len(vectors):
+            raise ValueError(f'{len(ids)} ids for {len(vectors)} vectors')
+        for start in range(0, len(ids), BLOCK_ROWS):
+            block = normalize(vectors[start:start + BLOCK_ROWS])
+            first_row = len(self.ids)
+            self.ids.extend(ids[start:start + BLOCK_ROWS])
+            labels = nearest(block, self.centroids)
+            order = np.argsort(labels, kind='stable')
+            lists, starts = np.unique(labels[order], return_index=True)
+            for i, members in zip(lists, np.split(order, starts[1:])):
+                self._append(i, block[members], first_row + members)
+
+    def search(self, query, k: int = 5, nprobe: int | None = None) -> list:
+        """Returns the k (id, score) pairs with the highest cosine similarity to the query among the vectors
+        of the nprobe nearest lists, best first."""
+        return self.search_batch([query], k, nprobe)[0]
+
+    def search_batch(self, queries, k: int = 5, nprobe: int | None = None) -> list:
+        """Searches several queries and returns a result list per query. Every probed list is scored once,
+        for all the queries that probe it."""
+        queries = normalize(queries)
+        probes = top_k(queries @ self.centroids.T, nprobe or self.nprobe)
+        # Group the queries by the lists they probe
+        flat = probes.ravel()
+        order = np.argsort(flat, kind='stable')
+        lists, starts = np.unique(flat[order], return_index=True)
+        candidate_scores = [[] for _ in queries]
+        candidate_rows = [[] for _ in queries]
+        for i, members in zip(lists, np.split(order // probes.shape[1], starts[1:])):
+            size = self.sizes[i]
+            if not size:
+                continue
+            scores = queries[members] @ self.vectors[i][:size].T
+            for query, query_scores in zip(members, scores):
+                candidate_scores[query].append(query_scores)
+                candidate_rows[query].append(self.rows[i][:size])
+
+        results = []
+        for scores, rows in zip(candidate_scores, candidate_rows):
+            if not scores:
+                results.append([])
+                continue
+            scores, rows = np.concatenate(scores), np.concatenate(rows)
+            best = top_k(scores[np.newaxis], k)[0]
+            results.append([(self.ids[rows[j]], float(scores[j])) for j in best])
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build an IVF index from an embedding store.')
+    parser.add_argument('--store', default='book_chunks', help='directory of the embedding store written by ingest.py')
+    parser.add_argument('--out', default='book_index', help='directory of the index')
+    parser.add_argument('--lists', type=int, default=None, help='number of lists, default 4 * sqrt(vectors)')
+    parser.add_argument('--nprobe', type=int, default=8, help='lists searched per query')
+    parser.add_argument('--sample-size', type=int, default=100000, help='vectors k-means is trained on')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    store = EmbeddingStore.load(args.store)
+    n_lists = args.lists or max(1, min(len(store), int(4 * np.sqrt(len(store)))))
+    start = time.perf_counter()
+    index = IVFIndex.from_store(store, n_lists, nprobe=args.nprobe, sample_size=args.sample_size, seed=args.seed)
+    index.save(args.out)
+    print(f"{len(index)} vectors in {n_lists} lists written to '{args.out}' in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
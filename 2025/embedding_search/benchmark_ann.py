@@ -0,0 +1,107 @@
+# benchmark_ann.py
+# Compares the IVF index of ann_index.py with the exact search of EmbeddingStore at every --sizes: recall@k
+# (the share of the exact top k that the index finds) and queries/sec for every --nprobes.
+# The vectors are clustered random vectors of --dim dimensions (384, like small sentence embedding models):
+# --topics random centers with noise of --spread around them. Uniform random vectors have no clusters, which
+# is the worst case for an IVF index and unlike the embeddings of real texts.
+# The index is trained on all but the last --insert-share of the vectors, which are then added to measure
+# incremental insertion. The search is timed on the index after saving it and loading it memory mapped.
+import argparse
+import json
+import os
+import platform
+import time
+
+import numpy as np
+
+from ann_index import IVFIndex
+from benchmark_search import random_vectors, timed, write_store
+
+SIZES = (10000, 100000, 1000000)
+NPROBES = (1, 2, 4, 8, 16, 32, 64)
+
+
+def recall(results: list, exact: list) -> float:
+    """Share of the exact results that were found, over all queries."""
+    found = sum(len({i for i, _ in result} & {i for i, _ in truth}) for result, truth in zip(results, exact))
+    return found / max(1, sum(len(truth) for truth in exact))
+
+
+def bench_size(size: int, args) -> dict:
+    rng = np.random.default_rng(args.seed)
+    centers = random_vectors(rng, args.topics, args.dim)
+    directory = os.path.join(args.data_dir, f'{size}x{args.dim}')
+    store = write_store(os.path.join(directory, 'store'), size, args.dim, args.seed, centers, args.spread)
+    queries = random_vectors(np.random.default_rng(args.seed + 1), args.queries, args.dim, centers, args.spread)
+    n_lists = args.lists or int(4 * np.sqrt(size))
+    result = {'vectors': size, 'dim': args.dim, 'k': args.k, 'queries': args.queries, 'lists': n_lists}
+
+    exact, seconds = timed(lambda query: store.search(query, args.k), queries)
+    result['exact_qps'] = round(1 / seconds, 1)
+    start = time.perf_counter()
+    store.search_batch(queries, args.k)
+    result['exact_batch_qps'] = round(len(queries) / (time.perf_counter() - start), 1)
+
+    trained = size - int(size * args.insert_share)
+    start = time.perf_counter()
+    index = IVFIndex.train(store.embeddings[:trained], n_lists, sample_size=args.sample_size, seed=args.seed)
+    index.add(store.embeddings[:trained], store.ids[:trained])
+    result['build_s'] = round(time.perf_counter() - start, 2)
+    if trained < size:
+        start = time.perf_counter()
+        index.add(store.embeddings[trained:], store.ids[trained:])
+        result['inserts_per_s'] = round((size - trained) / (time.perf_counter() - start), 1)
+    start = time.perf_counter()
+    index.save(os.path.join(directory, 'index'))
+    result['save_s'] = round(time.perf_counter() - start, 2)
+    del index
+    start = time.perf_counter()
+    index = IVFIndex.load(os.path.join(directory, 'index'))
+    result['load_s'] = round(time.perf_counter() - start, 3)
+
+    result['nprobe'] = []
+    for nprobe in args.nprobes:
+        if nprobe > n_lists:
+            continue
+        found, seconds = timed(lambda query: index.search(query, args.k, nprobe), queries)
+        start = time.perf_counter()
+        index.search_batch(queries, args.k, nprobe)
+        batch = time.perf_counter() - start
+        result['nprobe'].append({'nprobe': nprobe, f'recall@{args.k}': round(recall(found, exact), 4),
+                                 'qps': round(1 / seconds, 1), 'batch_qps': round(len(queries) / batch, 1),
+                                 'speedup': round(1 / seconds / result['exact_qps'], 1)})
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the IVF index against exact search.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES), help='numbers of vectors')
+    parser.add_argument('--dim', type=int, default=384, help='dimension of the vectors')
+    parser.add_argument('--topics', type=int, default=1000, help='cluster centers of the vectors')
+    parser.add_argument('--spread', type=float, default=1.0, help='noise around the centers, 1 is as long as a center')
+    parser.add_argument('--lists', type=int, default=None, help='lists of the index, default 4 * sqrt(vectors)')
+    parser.add_argument('--nprobes', type=int, nargs='+', default=list(NPROBES), help='lists searched per query')
+    parser.add_argument('--k', type=int, default=10, help='results per query')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--insert-share', type=float, default=0.1, help='share of the vectors added after training')
+    parser.add_argument('--sample-size', type=int, default=100000, help='vectors k-means is trained on')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--data-dir', default='benchmark_data', help='where the stores and indexes are written')
+    parser.add_argument('--out', default='benchmark_ann.json')
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        result = bench_size(size, args)
+        results.append(result)
+        print(json.dumps(result))
+
+    with open(args.out, 'w') as f:
+        json.dump({'environment': {'python': platform.python_version(), 'numpy': np.__version__,
+                                   'machine': platform.machine(), 'cpus': os.cpu_count()},
+                   'results': results}, f, indent=2)
+    print(f"Results written to '{args.out}'")
+
+
+if __name__ == "__main__":
+    main()
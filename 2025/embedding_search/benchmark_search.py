@@ -0,0 +1,121 @@
+# benchmark_search.py
+# Compares the search of the notebook (a loop over a {filename: embedding} dict with one sklearn
+# cosine_similarity call per book) with EmbeddingStore (one matrix product and argpartition) at every --sizes.
+# The embeddings are random vectors of --dim dimensions, written to a memory-mapped store in --data-dir block by
+# block, so stores larger than the memory can be benchmarked; Qwen3-Embedding-0.6B of the notebook has 1024.
+# For every size the JSON results hold the mean latency of a single query for the loop, the store searched
+# one query at a time and all --queries in one search_batch call, and queries/sec. The loop takes about half a
+# millisecond per vector, so it is only run up to --loop-max vectors; there the top results are checked to match.
+import argparse
+import json
+import os
+import platform
+import time
+
+import numpy as np
+from sklearn.metrics.pairwise import cosine_similarity
+
+from embedding_store import BLOCK_ROWS, EMBEDDINGS_FILE, IDS_FILE, EmbeddingStore, normalize
+
+SIZES = (1000, 10000, 100000, 1000000)
+
+
+def random_vectors(rng, count: int, dim: int, centers: np.ndarray | None = None, spread: float = 1.0) -> np.ndarray:
+    """Random normalized vectors. With centers, every vector is a random center plus noise of the given spread,
+    so the vectors form clusters like the embeddings of texts on a few topics."""
+    noise = rng.standard_normal((count, dim), dtype=np.float32)
+    if centers is None:
+        return normalize(noise)
+    return normalize(centers[rng.integers(len(centers), size=count)] + spread / np.sqrt(dim) * noise)
+
+
+def write_store(directory: str, size: int, dim: int, seed: int, centers: np.ndarray | None = None,
+                spread: float = 1.0) -> EmbeddingStore:
+    """Writes a store of random vectors without holding the matrix in memory."""
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    matrix = np.lib.format.open_memmap(os.path.join(directory, EMBEDDINGS_FILE), mode='w+',
+                                       dtype=np.float32, shape=(size, dim))
+    for start in range(0, size, BLOCK_ROWS):
+        rows = min(BLOCK_ROWS, size - start)
+        matrix[start:start + rows] = random_vectors(rng, rows, dim, centers, spread)
+    matrix.flush()
+    del matrix
+    with open(os.path.join(directory, IDS_FILE), 'w', encoding='utf-8') as f:
+        json.dump([f'book-{i}.txt' for i in range(size)], f)
+    return EmbeddingStore.load(directory)
+
+
+def find_top_n_books(query_embedding, book_embeddings: dict, n: int = 5) -> list:
+    """The search loop of the notebook, without embedding the query."""
+    query_embedding = query_embedding.reshape(1, -1)
+    similarities = {}
+    for filename, book_embedding in book_embeddings.items():
+        book_embedding = book_embedding.reshape(1, -1)
+        similarities[filename] = cosine_similarity(query_embedding, book_embedding)[0][0]
+    return sorted(similarities.items(), key=lambda item: item[1], reverse=True)[:n]
+
+
+def timed(function, items) -> tuple:
+    """Calls the function on every item and returns the results and the mean seconds per call."""
+    start = time.perf_counter()
+    results = [function(item) for item in items]
+    return results, (time.perf_counter() - start) / len(items)
+
+
+def bench_size(size: int, args) -> dict:
+    store = write_store(os.path.join(args.data_dir, f'{size}x{args.dim}'), size, args.dim, args.seed)
+    queries = np.random.default_rng(args.seed + 1).standard_normal((args.queries, args.dim), dtype=np.float32)
+    store.search(queries[0], args.k)  # read the matrix into the page cache once
+
+    result = {'vectors': size, 'dim': args.dim, 'k': args.k, 'queries': args.queries,
+              'matrix_mb': round(store.embeddings.nbytes / 2**20, 1)}
+    _, single = timed(lambda query: store.search(query, args.k), queries)
+    start = time.perf_counter()
+    batch_results = store.search_batch(queries, args.k)
+    batch = (time.perf_counter() - start) / len(queries)
+    result['store_ms'] = round(single * 1000, 3)
+    result['store_qps'] = round(1 / single, 1)
+    result['batch_ms'] = round(batch * 1000, 3)
+    result['batch_qps'] = round(1 / batch, 1)
+
+    if size <= args.loop_max:
+        book_embeddings = dict(zip(store.ids, np.asarray(store.embeddings)))
+        loop_results, loop = timed(lambda query: find_top_n_books(query, book_embeddings, args.k),
+                                   queries[:args.loop_queries])
+        result['loop_ms'] = round(loop * 1000, 3)
+        result['loop_qps'] = round(1 / loop, 1)
+        result['speedup'] = round(loop / single, 1)
+        result['same_results'] = all([book for book, _ in loop_result] == [book for book, _ in batch_result]
+                                     for loop_result, batch_result in zip(loop_results, batch_results))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the notebook search loop against EmbeddingStore.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES), help='numbers of vectors')
+    parser.add_argument('--dim', type=int, default=1024, help='dimension of the vectors')
+    parser.add_argument('--k', type=int, default=5, help='results per query')
+    parser.add_argument('--queries', type=int, default=100, help='queries timed for the store')
+    parser.add_argument('--loop-queries', type=int, default=3, help='queries timed for the loop')
+    parser.add_argument('--loop-max', type=int, default=10000, help='largest size the loop is run at')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--data-dir', default='benchmark_data', help='where the stores are written')
+    parser.add_argument('--out', default='benchmark_search.json')
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        result = bench_size(size, args)
+        results.append(result)
+        print(json.dumps(result))
+
+    with open(args.out, 'w') as f:
+        json.dump({'environment': {'python': platform.python_version(), 'numpy': np.__version__,
+                                   'machine': platform.machine(), 'cpus': os.cpu_count()},
+                   'results': results}, f, indent=2)
+    print(f"Results written to '{args.out}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# embedding_store.py
+# An embedding store for the semantic search of Embedding_search.ipynb.
+# The vectors are kept as one contiguous float32 matrix in embeddings.npy, normalized to length 1 when they are
+# stored, so the cosine similarity of a query with every vector is a single matrix-vector product. The ids
+# (book file names) are kept in the same order in ids.json. The matrix is opened memory mapped: loading is
+# instant, and a store larger than the memory is read from the page cache block by block while searching.
+# The best k of the scores are picked with argpartition, so only those k are sorted.
+# Run this file to convert the pickled {filename: embedding} dict of the notebook into a store.
+import argparse
+import json
+import os
+import pickle
+
+import numpy as np
+
+EMBEDDINGS_FILE = 'embeddings.npy'
+IDS_FILE = 'ids.json'
+BLOCK_ROWS = 65536  # rows of the matrix scored at once, bounds the memory for the scores of a batch of queries
+
+
+def normalize(vectors) -> np.ndarray:
+    """Returns the vectors as float32 rows of length 1. Zero vectors stay zero and match nothing."""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores of every row, best first."""
+    k = max(0, min(k, scores.shape[1]))
+    if k == 0:
+        return np.empty((scores.shape[0], 0), dtype=np.intp)
+    if k < scores.shape[1]:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(k), (scores.shape[0], k))
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+def save_array(path: str, array: np.ndarray):
+    """Writes an .npy file under a temporary name and then renames it, so a reader never sees half a file."""
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, np.ascontiguousarray(array))
+    os.replace(path + '.tmp', path)
+
+
+def save_json(path: str, data):
+    """Writes a JSON file under a temporary name and then renames it."""
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(path + '.tmp', path)
+
+
+class EmbeddingStore:
+    """Normalized embeddings in one matrix and their ids, searched by cosine similarity."""
+
+    def __init__(self, embeddings, ids: list, normalized: bool = False):
+        self.embeddings = embeddings if normalized else normalize(embeddings)
+        self.ids = list(ids)
+        if len(self.ids) != len(self.embeddings):
+            raise ValueError(f'{len(self.ids)} ids for {len(self.embeddings)} embeddings')
+
+    @classmethod
+    def from_dict(cls, embeddings: dict) -> 'EmbeddingStore':
+        """Builds a store from a {id: embedding} dict, like book_embeddings of the notebook."""
+        return cls(np.stack(list(embeddings.values())), list(embeddings))
+
+    @classmethod
+    def from_pickle(cls, filename: str) -> 'EmbeddingStore':
+        """Builds a store from a pickled {id: embedding} dict, like book_snippet_embeddings.pkl."""
+        with open(filename, 'rb') as f:
+            return cls.from_dict(pickle.load(f))
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> 'EmbeddingStore':
+        """Opens a saved store. With mmap the matrix is read from disk when it is searched."""
+        embeddings = np.load(os.path.join(directory, EMBEDDINGS_FILE), mmap_mode='r' if mmap else None)
+        with open(os.path.join(directory, IDS_FILE), encoding='utf-8') as f:
+            ids = json.load(f)
+        return cls(embeddings, ids, normalized=True)
+
+    def save(self, directory: str):
+        """Writes the matrix and the ids."""
+        os.makedirs(directory, exist_ok=True)
+        save_array(os.path.join(directory, EMBEDDINGS_FILE), np.asarray(self.embeddings, dtype=np.float32))
+        save_json(os.path.join(directory, IDS_FILE), self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def dim(self) -> int:
+        return self.embeddings.shape[1]
+
+    def search(self, query, k: int = 5) -> list:
+        """Returns the k (id, score) pairs with the highest cosine similarity to the query, best first."""
+        return self.search_batch([query], k)[0]
+
+    def search_batch(self, queries, k: int = 5) -> list:
+        """Searches several queries in one pass over the matrix and returns a result list per query.
+        The matrix is scored in blocks of BLOCK_ROWS; the best k of every block are kept and the best
+        k of those are the result."""
+        queries = normalize(queries)
+        if not len(self):
+            return [[] for _ in queries]
+        best_indices, best_scores = [], []
+        for start in range(0, len(self), BLOCK_ROWS):
+            scores = queries @ self.embeddings[start:start + BLOCK_ROWS].T
+            indices = top_k(scores, k)
+            best_indices.append(indices + start)
+            best_scores.append(np.take_along_axis(scores, indices, axis=1))
+        indices, scores = np.hstack(best_indices), np.hstack(best_scores)
+        order = top_k(scores, k)
+        indices = np.take_along_axis(indices, order, axis=1)
+        scores = np.take_along_axis(scores, order, axis=1)
+        return [[(self.ids[i], float(score)) for i, score in zip(row_indices, row_scores)]
+                for row_indices, row_scores in zip(indices, scores)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert pickled {id: embedding} dict into an embedding store.')
+    parser.add_argument('--pickle', default='book_snippet_embeddings.pkl', help='pickled embeddings of the notebook')
+    parser.add_argument('--out', default='book_embeddings', help='directory of the store')
+    args = parser.parse_args()
+
+    store = EmbeddingStore.from_pickle(args.pickle)
+    store.save(args.out)
+    print(f"{len(store)} embeddings of dimension {store.dim} written to '{args.out}'")
+
+
+if __name__ == "__main__":
+    main()
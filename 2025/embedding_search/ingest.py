@@ -0,0 +1,207 @@
+# ingest.py
+# Incremental embedding of whole books for the semantic search of Embedding_search.ipynb.
+# Every book is split into chunks of --chunk-words words that overlap by --overlap words, so no passage is only
+# seen cut in half, and the chunks are encoded in batches with a small sentence embedding model on the CPU.
+# The embeddings of a book are saved in chunks/<hash>.npy, named by the SHA-256 of the book file. The manifest
+# (manifest.json) maps every file name to its hash and number of chunks, so a run only encodes the books that
+# are new or changed; a renamed book keeps its embeddings. If the model or the chunk settings change, every
+# book is encoded again. After a run, all chunks are written to an EmbeddingStore (see embedding_store.py) with
+# the ids "<filename>#<chunk>", and the run reports the chunks encoded per second.
+# Query embeddings go through a bounded LRU cache, so repeated queries are not encoded again.
+import argparse
+import functools
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from embedding_store import EmbeddingStore, save_array, save_json
+
+MODEL_NAME = 'sentence-transformers/all-MiniLM-L6-v2'  # 384 dimensions, fast enough on a CPU
+CHUNK_WORDS = 200
+OVERLAP_WORDS = 40
+BATCH_SIZE = 32
+ENCODE_CHUNKS = 1024  # chunks collected from several books before they are encoded, so small books fill batches
+MANIFEST_FILE = 'manifest.json'
+CHUNKS_DIR = 'chunks'
+
+
+def load_model(name: str = MODEL_NAME, device: str = 'cpu'):
+    """Loads a SentenceTransformer model by name or local path."""
+    from sentence_transformers import SentenceTransformer  # imported here, the other helpers do not need it
+    return SentenceTransformer(name, device=device)
+
+
+def file_hash(path: str) -> str:
+    """SHA-256 of a file's content, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def split_chunks(text: str, chunk_words: int = CHUNK_WORDS, overlap: int = OVERLAP_WORDS) -> list:
+    """Splits a text into chunks of chunk_words words; each chunk repeats the last overlap words of the one
+    before it."""
+    if not 0 <= overlap < chunk_words:
+        raise ValueError(f'overlap must be at least 0 and less than chunk_words, got {overlap}')
+    words = text.split()
+    step = chunk_words - overlap
+    return [" ".join(words[start:start + chunk_words])
+            for start in range(0, max(1, len(words) - overlap), step)]
+
+
+class QueryEncoder:
+    """Encodes queries with the model, keeping the embeddings of the last cache_size queries."""
+
+    def __init__(self, model, cache_size: int = 1024):
+        self.model = model
+        self.encode = functools.lru_cache(maxsize=cache_size)(self._encode)
+
+    def _encode(self, query: str) -> np.ndarray:
+        embedding = self.model.encode(query, convert_to_numpy=True, normalize_embeddings=True)
+        embedding.flags.writeable = False  # the cached array is shared by every caller
+        return embedding
+
+    def cache_info(self):
+        return self.encode.cache_info()
+
+
+class Ingestion:
+    """Encodes the new and changed books of a directory and keeps the embeddings of the others."""
+
+    def __init__(self, model, out_dir: str, model_name: str = MODEL_NAME, chunk_words: int = CHUNK_WORDS,
+                 overlap: int = OVERLAP_WORDS, batch_size: int = BATCH_SIZE, encode_chunks: int = ENCODE_CHUNKS):
+        self.model = model
+        self.out_dir = out_dir
+        self.batch_size = batch_size
+        self.encode_chunks = encode_chunks
+        self.chunk_words = chunk_words
+        self.overlap = overlap
+        self.settings = {'model': model_name, 'chunk_words': chunk_words, 'overlap': overlap}
+        self.manifest = self.read_manifest()
+        self.encoded_chunks = 0
+        self.encode_seconds = 0.0
+
+    def read_manifest(self) -> dict:
+        """Reads the manifest. Without one, or if the settings changed, the saved embeddings are deleted and
+        a new manifest is written right away, so the files in chunks/ always belong to its settings."""
+        path = os.path.join(self.out_dir, MANIFEST_FILE)
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest['settings'] == self.settings:
+                return manifest
+            print("Model or chunk settings changed, all books are encoded again.")
+        chunks_dir = os.path.join(self.out_dir, CHUNKS_DIR)
+        os.makedirs(chunks_dir, exist_ok=True)
+        for name in os.listdir(chunks_dir):
+            os.remove(os.path.join(chunks_dir, name))
+        manifest = {'settings': self.settings, 'books': {}}
+        save_json(path, manifest)
+        return manifest
+
+    def chunk_path(self, digest: str) -> str:
+        return os.path.join(self.out_dir, CHUNKS_DIR, digest + '.npy')
+
+    def encode(self, pending: list):
+        """Encodes the chunks of several books in one call and saves the embeddings of every book."""
+        chunks = [chunk for _, _, book_chunks in pending for chunk in book_chunks]
+        start = time.perf_counter()
+        embeddings = self.model.encode(chunks, batch_size=self.batch_size, convert_to_numpy=True,
+                                       normalize_embeddings=True)
+        seconds = time.perf_counter() - start
+        self.encoded_chunks += len(chunks)
+        self.encode_seconds += seconds
+        print(f"Encoded {len(chunks)} chunks of {len(pending)} books, {len(chunks) / seconds:,.1f} chunks/sec")
+        offset = 0
+        for filename, digest, book_chunks in pending:
+            save_array(self.chunk_path(digest), np.asarray(embeddings[offset:offset + len(book_chunks)],
+                                                           dtype=np.float32))
+            self.manifest['books'][filename] = {'hash': digest, 'chunks': len(book_chunks)}
+            offset += len(book_chunks)
+
+    def run(self, data_dir: str) -> EmbeddingStore:
+        """Brings the embeddings up to date with the .txt files of data_dir and returns the store of all chunks."""
+        filenames = sorted(name for name in os.listdir(data_dir) if name.endswith('.txt'))
+        books = self.manifest['books']
+        for filename in set(books) - set(filenames):  # removed books
+            del books[filename]
+
+        pending, pending_chunks, reused = [], 0, 0
+        for filename in filenames:
+            path = os.path.join(data_dir, filename)
+            digest = file_hash(path)
+            if os.path.exists(self.chunk_path(digest)):  # unchanged, renamed or a copy of another book
+                if books.get(filename, {}).get('hash') != digest:
+                    chunks = len(np.load(self.chunk_path(digest), mmap_mode='r'))
+                    books[filename] = {'hash': digest, 'chunks': chunks}
+                reused += 1
+                continue
+            with open(path, encoding='utf-8') as f:
+                book_chunks = split_chunks(f.read(), self.chunk_words, self.overlap)
+            pending.append((filename, digest, book_chunks))
+            pending_chunks += len(book_chunks)
+            if pending_chunks >= self.encode_chunks:
+                self.encode(pending)
+                pending, pending_chunks = [], 0
+        if pending:
+            self.encode(pending)
+        save_json(os.path.join(self.out_dir, MANIFEST_FILE), self.manifest)
+
+        # Embeddings of books that are no longer in the directory
+        used = {book['hash'] + '.npy' for book in books.values()}
+        for name in os.listdir(os.path.join(self.out_dir, CHUNKS_DIR)):
+            if name.endswith('.npy') and name not in used:
+                os.remove(os.path.join(self.out_dir, CHUNKS_DIR, name))
+
+        print(f"{len(filenames)} books: {len(filenames) - reused} encoded, {reused} unchanged")
+        if self.encoded_chunks:
+            print(f"{self.encoded_chunks} chunks in {self.encode_seconds:.1f}s, "
+                  f"{self.encoded_chunks / self.encode_seconds:,.1f} chunks/sec")
+        return self.build_store(filenames)
+
+    def build_store(self, filenames: list) -> EmbeddingStore:
+        """Collects the chunks of all books into one store, saved in out_dir."""
+        embeddings, ids = [], []
+        for filename in filenames:
+            book = np.load(self.chunk_path(self.manifest['books'][filename]['hash']))
+            embeddings.append(book)
+            ids.extend(f'{filename}#{i}' for i in range(len(book)))
+        matrix = np.concatenate(embeddings) if embeddings else np.empty((0, 0), dtype=np.float32)
+        store = EmbeddingStore(matrix, ids, normalized=True)
+        store.save(self.out_dir)
+        return store
+
+
+def top_books(results: list, n: int = 5) -> list:
+    """Turns chunk search results ("<filename>#<chunk>", score) into the n best books, each with the score of its
+    best chunk. Search for several times n chunks, a good book often has many good chunks."""
+    books = {}
+    for chunk_id, score in results:
+        books.setdefault(chunk_id.rsplit('#', 1)[0], score)
+    return list(books.items())[:n]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Embed the new and changed books of a directory in chunks.')
+    parser.add_argument('--data-dir', default='data', help='directory of the .txt books')
+    parser.add_argument('--out', default='book_chunks', help='directory of the embeddings, manifest and store')
+    parser.add_argument('--model', default=MODEL_NAME, help='SentenceTransformer model name or local path')
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--chunk-words', type=int, default=CHUNK_WORDS)
+    parser.add_argument('--overlap', type=int, default=OVERLAP_WORDS, help='words shared by neighbouring chunks')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    ingestion = Ingestion(load_model(args.model, args.device), args.out, args.model, args.chunk_words,
+                          args.overlap, args.batch_size)
+    store = ingestion.run(args.data_dir)
+    print(f"{len(store)} chunks written to '{args.out}'")
+
+
+if __name__ == "__main__":
+    main()
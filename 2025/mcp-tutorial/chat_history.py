@@ -0,0 +1,141 @@
+# chat_history.py
+# Conversation history with a token budget, used by ollama_client.py and openai_client.py.
+# The history holds exactly one system prompt and a list of turns. A turn is a user message with everything
+# that answered it: assistant messages, tool calls and tool results. Before every request the oldest turns
+# are removed until the prompt fits into max_tokens, so a tool call is never separated from its result.
+# Each removed turn is compacted into one line ("user asked ... / assistant answered ...") of a summary
+# that is appended to the system prompt. The summary itself is limited to a share of the budget.
+# Token counts are estimates (tiktoken if installed, about 4 characters per token otherwise); the counts
+# reported by the model server are recorded next to them for every request.
+import json
+import math
+
+try:
+    import tiktoken  # optional, more exact token counts
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # not installed, or the encoding cannot be downloaded
+    _encoding = None
+
+MESSAGE_OVERHEAD = 4  # tokens for the role and the separators of a message
+SUMMARY_LINE_CHARS = 200
+
+
+def count_tokens(text: str) -> int:
+    """Estimates the number of tokens of a text."""
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return math.ceil(len(text) / 4)
+
+
+def field(message, name):
+    """Reads a field of a message, which can be a dict or a message object of the Ollama or OpenAI library."""
+    if isinstance(message, dict):
+        return message.get(name)
+    return getattr(message, name, None)
+
+
+def message_tokens(message) -> int:
+    """Estimates the tokens of a message, with its tool calls."""
+    text = field(message, 'content') or ''
+    tool_calls = field(message, 'tool_calls')
+    if tool_calls:
+        text += str(tool_calls)
+    return count_tokens(text) + MESSAGE_OVERHEAD
+
+
+def shorten(text: str, limit: int = SUMMARY_LINE_CHARS) -> str:
+    text = ' '.join(str(text or '').split())
+    return text if len(text) <= limit else text[:limit - 3] + '...'
+
+
+class ChatHistory:
+    """Keeps one system prompt and as many recent turns as fit into a token budget."""
+
+    def __init__(self, system_prompt: str, max_tokens: int = 4000, reserved_tokens: int = 0,
+                 summary_share: float = 0.25):
+        # reserved_tokens: the part of the prompt outside the messages, like the tool definitions
+        self.system_prompt = system_prompt
+        self.max_tokens = max_tokens
+        self.reserved_tokens = reserved_tokens
+        self.summary_share = summary_share
+        self.turns = []      # every turn is a list of (message, tokens)
+        self.summary = []    # one line per compacted turn
+        self.compacted_turns = 0
+        self.prompt_tokens = 0
+        self.requests = []   # statistics of every request
+        self.turn_stats = []  # latency of every turn, from the user's input to the end of the answer
+
+    def start_turn(self, user_input: str):
+        """Starts a new turn with the user's message."""
+        self.turns.append([])
+        self.add({'role': 'user', 'content': user_input})
+
+    def add(self, message):
+        """Adds a message (assistant answer, tool call or tool result) to the current turn."""
+        self.turns[-1].append((message, message_tokens(message)))
+
+    def system_message(self) -> dict:
+        content = self.system_prompt
+        if self.summary:
+            content += "\n\nSummary of the earlier conversation:\n" + "\n".join(self.summary)
+        return {'role': 'system', 'content': content}
+
+    def compact(self, turn):
+        """Replaces a removed turn by one summary line and keeps the summary within its share of the budget."""
+        question = next((field(m, 'content') for m, _ in turn if field(m, 'role') == 'user'), '')
+        answer = next((field(m, 'content') for m, _ in reversed(turn)
+                       if field(m, 'role') == 'assistant' and field(m, 'content')), '')
+        tools = sorted({field(m, 'name') or field(m, 'tool_name') for m, _ in turn if field(m, 'role') == 'tool'} - {None})
+        line = f"- user asked: {shorten(question)} / assistant answered: {shorten(answer)}"
+        if tools:
+            line += f" (tools: {', '.join(tools)})"
+        self.summary.append(line)
+        self.compacted_turns += 1
+        limit = self.summary_share * self.max_tokens
+        while len(self.summary) > 1 and count_tokens("\n".join(self.summary)) > limit:
+            self.summary.pop(0)
+
+    def messages(self) -> list:
+        """Returns the messages of the next request: the system prompt and the most recent turns that fit."""
+        def total():
+            return (self.reserved_tokens + message_tokens(self.system_message())
+                    + sum(tokens for turn in self.turns for _, tokens in turn))
+        # The current turn is always kept, even if it alone is over the budget
+        while len(self.turns) > 1 and total() > self.max_tokens:
+            self.compact(self.turns.pop(0))
+        self.prompt_tokens = total()
+        return [self.system_message()] + [message for turn in self.turns for message, _ in turn]
+
+    def record_request(self, seconds: float, prompt_tokens: int | None = None,
+                       first_token: float | None = None) -> dict:
+        """Records the latency of a request, its time to first token when streamed and the prompt tokens
+        reported by the server, if any."""
+        stats = {'turn': self.compacted_turns + len(self.turns), 'estimated_prompt_tokens': self.prompt_tokens,
+                 'prompt_tokens': prompt_tokens, 'latency_s': round(seconds, 3),
+                 'first_token_s': round(first_token, 3) if first_token is not None else None,
+                 'turns_kept': len(self.turns), 'turns_compacted': self.compacted_turns}
+        self.requests.append(stats)
+        first = f", first token after {first_token:.2f}s" if first_token is not None else ""
+        print(f"--- Client: prompt {prompt_tokens if prompt_tokens is not None else '?'} tokens "
+              f"({self.prompt_tokens} estimated, {len(self.turns)} turns kept, {self.compacted_turns} compacted), "
+              f"{seconds:.2f}s{first} ---")
+        return stats
+
+    def record_turn(self, seconds: float, first_token: float | None = None) -> dict:
+        """Records the latency of a whole turn and the time until the first token of the answer was shown."""
+        stats = {'turn': self.compacted_turns + len(self.turns), 'latency_s': round(seconds, 3),
+                 'first_token_s': round(first_token, 3) if first_token is not None else None}
+        self.turn_stats.append(stats)
+        first = f", answer started after {first_token:.2f}s" if first_token is not None else ""
+        print(f"--- Client: turn took {seconds:.2f}s{first} ---")
+        return stats
+
+    def save_stats(self, filename: str):
+        """Writes the statistics of all requests and turns to a JSON file."""
+        with open(filename, 'w') as f:
+            json.dump({'requests': self.requests, 'turns': self.turn_stats}, f, indent=2)
+
+
+def tools_tokens(tools: list) -> int:
+    """Estimates the prompt tokens taken by the tool definitions."""
+    return count_tokens(json.dumps(tools))
@@ -0,0 +1,252 @@
+# mcp_pool.py
+# A pool of warm MCP server sessions, shared by the chat clients (ollama_client.py, openai_client.py).
+# Starting mcp_server.py and the MCP handshake cost time on every run. The pool starts `size` server
+# processes once and lends their sessions to any number of concurrent chat sessions. An MCP session handles
+# several requests at the same time, so every process serves up to `calls_per_session` tool calls at once;
+# further calls wait for a free slot. The tool definitions are cached and only fetched again after a server
+# announces that its tool list changed (notifications/tools/list_changed).
+# The pool reports how long calls waited for a session and how busy the sessions were.
+#
+# Run `python mcp_pool.py --serve` to keep the pool running as a service: it serves the tools of its servers
+# over streamable HTTP at http://HOST:PORT/mcp, so many chat clients share the same warm server processes.
+# A chat client connects to it when MCP_POOL_URL is set, and starts its own MCP_POOL_SIZE servers otherwise.
+# Run this file without --serve to simulate many chat sessions on one pool and compare with starting a server
+# per session; with --url the simulated chats use a running pool service instead.
+import argparse
+import asyncio
+import os
+import sys
+import time
+import weakref
+from collections import deque
+from contextlib import AsyncExitStack, asynccontextmanager
+
+from mcp import ClientSession, StdioServerParameters, types
+from mcp.client.stdio import stdio_client
+from mcp.client.streamable_http import streamable_http_client
+
+POOL_URL = os.environ.get("MCP_POOL_URL")  # e.g. http://127.0.0.1:8765/mcp, started with --serve
+POOL_SIZE = int(os.environ.get("MCP_POOL_SIZE", "1"))  # server processes (or sessions to the service) of a client
+
+
+def to_function_tools(tool_list_response) -> list:
+    """Formats the MCP tool definitions as function tools for Ollama and OpenAI."""
+    return [{
+        'type': 'function',
+        'function': {
+            'name': tool.name,
+            'description': tool.description,
+            'parameters': tool.inputSchema,
+        },
+    } for tool in tool_list_response.tools]
+
+
+@asynccontextmanager
+async def connect(server: StdioServerParameters | str):
+    """Opens the transport to an MCP server: a subprocess, or the URL of a pool service."""
+    if isinstance(server, str):
+        async with streamable_http_client(server) as (read, write, _):
+            yield read, write
+    else:
+        async with stdio_client(server) as (read, write):
+            yield read, write
+
+
+class MCPSessionPool:
+    """Keeps MCP server processes running and multiplexes tool calls of many chat sessions over them."""
+
+    def __init__(self, server: StdioServerParameters | str, size: int = 2, calls_per_session: int = 4):
+        self.server = server
+        self.size = size
+        self.calls_per_session = calls_per_session
+        self._stack = AsyncExitStack()
+        self._free = asyncio.Queue()  # one entry per free call slot of a session
+        self._tool_list = None
+        self._tools_version = 0
+        self._tools_lock = asyncio.Lock()  # concurrent chats wait for one fetch instead of each fetching
+        self.tools_changed_callbacks = []  # async functions called when a server's tool list changed
+        self.acquires = 0
+        self.waits = deque(maxlen=10000)  # seconds every recent acquire waited for a slot
+        self.busy_seconds = 0.0
+        self.started = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def start(self):
+        """Starts the server processes, or connects to the pool service. They are opened one after the
+        other: a transport has to be closed by the task that opened it."""
+        print(f"--- Pool: Starting {self.size} MCP session(s)... ---")
+        for _ in range(self.size):
+            read, write = await self._stack.enter_async_context(connect(self.server))
+            session = await self._stack.enter_async_context(
+                ClientSession(read, write, message_handler=self._on_message))
+            await session.initialize()
+            for _ in range(self.calls_per_session):
+                self._free.put_nowait(session)
+        self.started = time.perf_counter()
+
+    async def close(self):
+        await self._stack.aclose()
+
+    async def _on_message(self, message):
+        # The only server message the pool cares about: the tool list changed, so the cached tools are stale
+        if isinstance(message, types.ServerNotification) and isinstance(message.root, types.ToolListChangedNotification):
+            self._tool_list = None
+            self._tools_version += 1
+            for callback in self.tools_changed_callbacks:
+                await callback()
+
+    @asynccontextmanager
+    async def session(self):
+        """Lends a session for one or more requests."""
+        start = time.perf_counter()
+        session = await self._free.get()
+        acquired = time.perf_counter()
+        self.acquires += 1
+        self.waits.append(acquired - start)
+        try:
+            yield session
+        finally:
+            self.busy_seconds += time.perf_counter() - acquired
+            self._free.put_nowait(session)
+
+    async def call_tool(self, name: str, arguments: dict | None = None) -> types.CallToolResult:
+        """Calls a tool on one of the pooled sessions, like ClientSession.call_tool."""
+        async with self.session() as session:
+            return await session.call_tool(name, arguments=arguments)
+
+    async def list_tools(self) -> types.ListToolsResult:
+        """Returns the MCP tool definitions, from the cache unless the tool list changed."""
+        async with self._tools_lock:
+            if self._tool_list is not None:
+                return self._tool_list
+            version = self._tools_version
+            async with self.session() as session:
+                tool_list = await session.list_tools()
+            if version == self._tools_version:  # no change announced while the list was fetched
+                self._tool_list = tool_list
+            return tool_list
+
+    async def tools(self) -> list:
+        """Returns the tool definitions for Ollama/OpenAI. Cheap while the tool list is cached, so chats can
+        ask for it on every turn and see a changed tool list."""
+        return to_function_tools(await self.list_tools())
+
+    def stats(self) -> dict:
+        """Wait times of the recent acquires and the share of the slot time the sessions were busy."""
+        waits = sorted(self.waits)
+        def percentile(p):
+            return waits[min(len(waits) - 1, int(p / 100 * len(waits)))] * 1000 if waits else 0.0
+        slots = self.size * self.calls_per_session
+        elapsed = time.perf_counter() - self.started if self.started else 0.0
+        return {'processes': self.size, 'slots': slots, 'acquires': self.acquires,
+                'wait_ms_mean': sum(waits) / len(waits) * 1000 if waits else 0.0,
+                'wait_ms_p50': percentile(50), 'wait_ms_p99': percentile(99), 'wait_ms_max': percentile(100),
+                'utilization': self.busy_seconds / (slots * elapsed) if elapsed else 0.0}
+
+
+def server_params(script: str = "mcp_server.py", args: list | None = None) -> StdioServerParameters:
+    # Use sys.executable to ensure the subprocess uses the same python
+    return StdioServerParameters(command=sys.executable, args=[script] + (args or []))
+
+
+def client_pool() -> MCPSessionPool:
+    """The pool of a chat client: sessions to the pool service at MCP_POOL_URL if it is set, otherwise
+    MCP_POOL_SIZE server processes of its own."""
+    return MCPSessionPool(POOL_URL or server_params(), POOL_SIZE)
+
+
+async def serve(pool: MCPSessionPool, host: str, port: int):
+    """Serves the tools of the pool over streamable HTTP at http://host:port/mcp until stopped. Every
+    connected chat session shares the pool's server processes."""
+    import uvicorn
+    from mcp.server.fastmcp.server import StreamableHTTPASGIApp
+    from mcp.server.lowlevel import Server
+    from mcp.server.streamable_http_manager import StreamableHTTPSessionManager
+    from starlette.applications import Starlette
+    from starlette.routing import Route
+
+    server = Server("MCP pool")
+    sessions = weakref.WeakSet()  # connected chat sessions, told when the tool list changes
+
+    @server.list_tools()
+    async def list_tools() -> list[types.Tool]:
+        sessions.add(server.request_context.session)
+        return (await pool.list_tools()).tools
+
+    # The pooled servers validate the arguments themselves
+    @server.call_tool(validate_input=False)
+    async def call_tool(name: str, arguments: dict) -> types.CallToolResult:
+        return await pool.call_tool(name, arguments)
+
+    async def tools_changed():
+        for session in list(sessions):
+            try:
+                await session.send_tool_list_changed()
+            except Exception:  # the chat session is gone
+                sessions.discard(session)
+
+    pool.tools_changed_callbacks.append(tools_changed)
+    manager = StreamableHTTPSessionManager(app=server)
+    app = Starlette(routes=[Route("/mcp", endpoint=StreamableHTTPASGIApp(manager))],
+                    lifespan=lambda app: manager.run())
+    print(f"--- Pool: Serving {pool.size} MCP server(s) at http://{host}:{port}/mcp ---")
+    await uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning")).serve()
+
+
+async def chat_session(pool: MCPSessionPool, calls: int, think_time: float):
+    """One simulated chat session: fetches the tools and makes tool calls with pauses, like a model would."""
+    await pool.tools()
+    for i in range(calls):
+        await pool.call_tool("calculator", {"num1": i, "num2": 2, "operator": "*"})
+        await asyncio.sleep(think_time)
+
+
+async def fresh_session_time(server: StdioServerParameters | str) -> float:
+    """Time to connect, initialize the session and list the tools, as every client run did before the pool."""
+    start = time.perf_counter()
+    async with connect(server) as (read, write):
+        async with ClientSession(read, write) as session:
+            await session.initialize()
+            to_function_tools(await session.list_tools())
+            return time.perf_counter() - start
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Share a pool of MCP servers between many chat sessions.')
+    parser.add_argument('--processes', type=int, default=2, help='MCP server processes in the pool')
+    parser.add_argument('--calls-per-session', type=int, default=4, help='concurrent calls per server process')
+    parser.add_argument('--serve', action='store_true', help='keep the pool running as a service for chat clients')
+    parser.add_argument('--host', default='127.0.0.1', help='address the service listens on')
+    parser.add_argument('--port', type=int, default=8765, help='port the service listens on')
+    parser.add_argument('--url', help='simulate the chats on a running pool service instead of own servers')
+    parser.add_argument('--chats', type=int, default=50, help='concurrent chat sessions')
+    parser.add_argument('--calls', type=int, default=5, help='tool calls per chat session')
+    parser.add_argument('--think-time', type=float, default=0.05, help='seconds between the calls of a chat')
+    args = parser.parse_args()
+
+    if args.serve:
+        async with MCPSessionPool(server_params(), args.processes, args.calls_per_session) as pool:
+            await serve(pool, args.host, args.port)
+        return
+
+    server = args.url or server_params()
+    startup = await fresh_session_time(server)
+    print(f"--- A fresh session takes {startup:.2f}s before the first tool call ---")
+
+    async with MCPSessionPool(server, args.processes, args.calls_per_session) as pool:
+        start = time.perf_counter()
+        await asyncio.gather(*(chat_session(pool, args.calls, args.think_time) for _ in range(args.chats)))
+        elapsed = time.perf_counter() - start
+        print(f"--- {args.chats} chat sessions with {args.calls} tool calls each in {elapsed:.2f}s ---")
+        for key, value in pool.stats().items():
+            print(f"{key:>14}: {value:.3f}" if isinstance(value, float) else f"{key:>14}: {value}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
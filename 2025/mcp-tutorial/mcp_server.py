@@ -1,12 +1,234 @@
+import argparse
+import asyncio
+import functools
+import json
+import multiprocessing
 import os
+import sys
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from pydantic import BaseModel
 from mcp.server.fastmcp import FastMCP
 
+# The NLP models of the course live in day_one/, next to the scripts that train them
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'day_one')
+sys.path.insert(0, MODELS_DIR)
+
 # 1. Create an MCP server instance
 mcp = FastMCP("MCP server example]")
 
+# Tools are async functions, so the server can work on several calls at the same time. Sync code would block the
+# stdio loop while it runs, so CPU-bound work is handed to a thread or process pool with run_in_pool. At most
+# MAX_CONCURRENT jobs are given to the pool at once; the other calls wait for their turn.
+POOL = {'kind': 'thread', 'workers': os.cpu_count() or 1, 'max_concurrent': 2 * (os.cpu_count() or 1)}
+MAX_BATCH = 10000  # operations per calculator_batch call
+LATENCY_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+_executor = None
+_limit = None
+
+def get_executor():
+    global _executor, _limit
+    if _executor is None:
+        if POOL['kind'] == 'process':
+            # Every worker process loads the NLP models once when it starts. The workers are spawned, not forked:
+            # a fork of this process would copy the threads of the event loop and of the loaded models
+            _executor = ProcessPoolExecutor(max_workers=POOL['workers'], mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=load_models, initargs=(MODELS_DIR,))
+        else:
+            _executor = ThreadPoolExecutor(max_workers=POOL['workers'])
+        _limit = asyncio.Semaphore(POOL['max_concurrent'])
+    return _executor, _limit
+
+async def run_in_pool(function, *args):
+    # function and its arguments must be picklable (defined at module level) for the process pool
+    executor, limit = get_executor()
+    async with limit:
+        return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(function, *args))
+
+class ToolMetrics:
+    # Number of calls, errors and a latency histogram of every tool, served as the metrics://tools resource
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.tools = {}
+
+    def record(self, name, seconds, failed):
+        stats = self.tools.setdefault(name, {'calls': 0, 'errors': 0, 'total_ms': 0.0,
+                                             'histogram': [0] * (len(self.buckets) + 1)})
+        ms = seconds * 1000
+        stats['calls'] += 1
+        stats['errors'] += int(failed)
+        stats['total_ms'] += ms
+        stats['histogram'][sum(1 for bound in self.buckets if ms > bound)] += 1
+
+    def snapshot(self):
+        labels = [f'<={bound}ms' for bound in self.buckets] + [f'>{self.buckets[-1]}ms']
+        return {name: {'calls': stats['calls'], 'errors': stats['errors'],
+                       'mean_ms': stats['total_ms'] / stats['calls'],
+                       'latency_histogram': dict(zip(labels, stats['histogram']))}
+                for name, stats in self.tools.items()}
+
+METRICS = ToolMetrics()
+
+class ResultCache:
+    # Bounded LRU cache of tool results, keyed by (tool, normalized input). It is only used from the
+    # event loop, so it needs no lock. A key that is being computed has a task in `pending`: concurrent
+    # calls on that key wait for it instead of computing the same result again.
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+        self.joined = 0  # calls that waited for a computation already in flight
+
+    async def get_or_compute(self, key, compute):
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        task = self.pending.get(key)
+        if task is None:
+            self.misses += 1
+            task = self.pending[key] = asyncio.ensure_future(compute())
+            task.add_done_callback(functools.partial(self._computed, key))
+        else:
+            self.joined += 1
+        # shield: a cancelled call does not cancel the computation the other calls wait for
+        return await asyncio.shield(task)
+
+    def _computed(self, key, task):
+        del self.pending[key]
+        if task.cancelled() or task.exception() is not None:
+            return  # errors are not cached, the next call tries again
+        self.entries[key] = task.result()
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)  # least recently used
+
+    def snapshot(self):
+        return {'entries': len(self.entries), 'max_entries': self.max_entries, 'hits': self.hits,
+                'misses': self.misses, 'joined': self.joined, 'in_flight': len(self.pending)}
+
+CACHE = ResultCache()
+
+def normalize_text(text):
+    # Cache key of a text: same characters composed the same way, runs of whitespace as one space
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+# The NLP models are loaded once at startup (and once per worker with --executor process) and kept in MODELS.
+# A model that was not trained yet is left out and its tool answers with the reason.
+MODELS = {}
+MISSING_MODELS = {}
+_loaded_from = None
+
+def load_models(directory):
+    global _loaded_from
+    if _loaded_from == directory:
+        return
+    import joblib
+    from nltk.tokenize import TreebankWordTokenizer
+    from hmm_arrays import load_hmm
+    from lan_identifier import LANGUAGES, NgramIndex, compile_profiles, load_profiles
+
+    profiles = os.path.join(directory, 'profiles')
+    if not os.path.isdir(profiles):  # compile from the training texts in day_one, whatever the working directory
+        compile_profiles(profiles, {lang: os.path.join(directory, name) for lang, name in LANGUAGES.items()})
+    MODELS['language'] = NgramIndex(load_profiles(profiles))
+    MODELS['word_tokenizer'] = TreebankWordTokenizer()
+
+    if os.path.isdir(os.path.join(directory, 'hmm_tagger_arrays')):
+        MODELS['pos'] = load_hmm(os.path.join(directory, 'hmm_tagger_arrays'))
+    elif os.path.exists(os.path.join(directory, 'hmm_tagger.pkl')):
+        import dill
+        with open(os.path.join(directory, 'hmm_tagger.pkl'), 'rb') as f:
+            MODELS['pos'] = dill.load(f)
+    else:
+        MISSING_MODELS['pos'] = 'run hmm_nltk.py in day_one first'
+
+    if os.path.exists(os.path.join(directory, 'text_classification_pipeline.pkl')):
+        MODELS['sentiment'] = joblib.load(os.path.join(directory, 'text_classification_pipeline.pkl'))
+    else:
+        MISSING_MODELS['sentiment'] = 'run sklearn_randomforest.py in day_one first'
+    _loaded_from = directory
+
+def get_model(name):
+    if name not in MODELS:
+        raise ValueError(f"The {name} model is not available: {MISSING_MODELS.get(name, 'not loaded')}.")
+    return MODELS[name]
+
+def tokenize_words(text):
+    from tokenizer import tokenize_text
+    return [token for token in tokenize_text(text).split('\n') if token]
+
+def identify(sentence):
+    from lan_identifier import LANGUAGE_NAMES, detect_language
+    language, scores = detect_language(sentence, get_model('language'))
+    return {'language': language, 'name': LANGUAGE_NAMES.get(language, language), 'scores': scores}
+
+def tag(text):
+    tokens = get_model('word_tokenizer').tokenize(text)
+    return [list(pair) for pair in get_model('pos').tag(tokens)]
+
+def classify_sentiment(text):
+    return str(get_model('sentiment').predict([text])[0])
+
+async def cached_in_pool(tool, key, function, *args):
+    # Answer from the result cache, or compute on the pool and remember the result
+    return await CACHE.get_or_compute((tool, key), lambda: run_in_pool(function, *args))
+
+def measured(tool):
+    # Record the latency of every call of an async tool. functools.wraps keeps the signature and the
+    # docstring, which FastMCP turns into the tool description for the LLM.
+    @functools.wraps(tool)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = await tool(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            METRICS.record(tool.__name__, time.perf_counter() - start, failed)
+    return wrapper
+
+def calculate(num1, num2, operator):
+    if operator == "+":
+        return num1 + num2
+    elif operator == "-":
+        return num1 - num2
+    elif operator == "*":
+        return num1 * num2
+    elif operator == "/":
+        if num2 == 0:
+            raise ValueError("Division by zero is not allowed.")
+        return num1 / num2
+    else:
+        raise ValueError(f"Unsupported operator: {operator}. Use one of '+', '-', '*', '/'.")
+
+def calculate_all(operations):
+    # Runs on the pool: the result of every operation, or its error message
+    results = []
+    for num1, num2, operator in operations:
+        try:
+            results.append(calculate(num1, num2, operator))
+        except ValueError as error:
+            results.append(str(error))
+    return results
+
+class Operation(BaseModel):
+    num1: float
+    num2: float
+    operator: str
+
 # 2. Define a tool using the @mcp.tool() decorator. What else is there beside @mcp.tool? define other tools or useful "stuff" to expose to the LLM
 @mcp.tool()
-def calculator(num1: float, num2: float, operator: str) -> float:
+@measured
+async def calculator(num1: float, num2: float, operator: str) -> float:
     """
     A simple calculator function that performs basic arithmetic operations.
 
@@ -17,7 +239,7 @@ def calculator(num1: float, num2: float, operator: str) -> float:
     num2 : float
         The second number in the calculation.
     operator : str
-        The arithmetic operation to perform. 
+        The arithmetic operation to perform.
         Supported values are:
         - "+" : addition
         - "-" : subtraction
@@ -34,23 +256,146 @@ def calculator(num1: float, num2: float, operator: str) -> float:
     ValueError
         If the operator is not supported or if division by zero is attempted.
     """
-    if operator == "+":
-        return num1 + num2
-    elif operator == "-":
-        return num1 - num2
-    elif operator == "*":
-        return num1 * num2
-    elif operator == "/":
-        if num2 == 0:
-            raise ValueError("Division by zero is not allowed.")
-        return num1 / num2
-    else:
-        raise ValueError(f"Unsupported operator: {operator}. Use one of '+', '-', '*', '/'.")
-        
+    return calculate(num1, num2, operator)
+
+@mcp.tool()
+@measured
+async def calculator_batch(operations: list[Operation]) -> list[float | str]:
+    """
+    Performs many basic arithmetic operations in one call. Use it instead of calling calculator several times.
+
+    Parameters
+    ----------
+    operations : list of objects
+        Each operation has "num1" (float), "num2" (float) and "operator", one of "+", "-", "*", "/".
+
+    Returns
+    -------
+    list
+        The result of every operation in the same order. An operation that fails (unsupported operator,
+        division by zero) gives its error message instead of a number.
+    """
+    if len(operations) > MAX_BATCH:
+        raise ValueError(f"At most {MAX_BATCH} operations per call, got {len(operations)}.")
+    return await run_in_pool(calculate_all, [(op.num1, op.num2, op.operator) for op in operations])
+
+# Tools that serve the NLP models trained in day_one/. Repeated calls on the same text are answered from the cache.
+@mcp.tool()
+@measured
+async def tokenize(text: str) -> list[str]:
+    """
+    Splits a text into tokens with the course tokenizer: punctuation marks become separate tokens.
+
+    Parameters
+    ----------
+    text : str
+        The text to tokenize.
+
+    Returns
+    -------
+    list of str
+        The tokens in order.
+    """
+    return await cached_in_pool('tokenize', text, tokenize_words, text)
+
+@mcp.tool()
+@measured
+async def identify_language(text: str) -> dict:
+    """
+    Identifies the language of a text (English, German or French) from its character n-grams.
+
+    Parameters
+    ----------
+    text : str
+        A sentence or longer text.
+
+    Returns
+    -------
+    dict
+        "language" (language code), "name" (language name) and "scores" (n-gram matches per language code).
+    """
+    from lan_identifier import normalize
+    sentence = normalize(text)  # the model only sees the lower-cased letters, so that is the cache key too
+    return await cached_in_pool('identify_language', sentence, identify, sentence)
+
+@mcp.tool()
+@measured
+async def pos_tag(text: str) -> list[list[str]]:
+    """
+    Tags every word of an English sentence with its part of speech (Penn Treebank tags like NN, VBD, DT)
+    using a Hidden Markov Model.
+
+    Parameters
+    ----------
+    text : str
+        An English sentence.
+
+    Returns
+    -------
+    list of [word, tag] pairs
+        The words of the sentence with their tags.
+    """
+    text = normalize_text(text)
+    return await cached_in_pool('pos_tag', text, tag, text)
+
+@mcp.tool()
+@measured
+async def sentiment(text: str) -> str:
+    """
+    Classifies the sentiment of an English review or sentence.
+
+    Parameters
+    ----------
+    text : str
+        The review or sentence.
+
+    Returns
+    -------
+    str
+        "positive" or "negative".
+    """
+    # The TF-IDF step lower-cases the text anyway, so differently cased texts share a cache entry
+    text = normalize_text(text).lower()
+    return await cached_in_pool('sentiment', text, classify_sentiment, text)
+
+# Resources are data the client can read, like files. This one reports how often each tool was called and how long it took
+@mcp.resource("metrics://tools")
+def tool_metrics() -> str:
+    """Number of calls, errors and latency histogram of every tool since the server started."""
+    return json.dumps(METRICS.snapshot())
+
+@mcp.resource("metrics://cache")
+def cache_metrics() -> str:
+    """Size, hits and misses of the result cache of the NLP tools."""
+    return json.dumps(CACHE.snapshot())
+
 
 # 3. Main entry point to run the server
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='MCP tool server over stdio.')
+    parser.add_argument('--executor', choices=['thread', 'process'], default=POOL['kind'],
+                        help='pool that runs the CPU-bound tools')
+    parser.add_argument('--workers', type=int, default=POOL['workers'])
+    parser.add_argument('--max-concurrent', type=int, default=POOL['max_concurrent'],
+                        help='pool jobs in flight at once, further calls wait')
+    parser.add_argument('--models-dir', default=MODELS_DIR, help='directory with the trained day_one models')
+    parser.add_argument('--cache-size', type=int, default=CACHE.max_entries, help='results kept by the LRU cache')
+    args = parser.parse_args()
+    POOL.update(kind=args.executor, workers=args.workers, max_concurrent=args.max_concurrent)
+    MODELS_DIR = args.models_dir
+    CACHE.max_entries = args.cache_size
+
+    # Load the models before the first request instead of on every request
+    load_models(MODELS_DIR)
+    for name, reason in MISSING_MODELS.items():
+        print(f"--- {name} model not available: {reason} ---", file=sys.stderr)
+    if POOL['kind'] == 'process':
+        # Start the worker processes now, so that they have loaded the models before the first call
+        executor, _ = get_executor()
+        for future in [executor.submit(os.getpid) for _ in range(POOL['workers'])]:
+            future.result()
+
     print("--- MCP Tool Server starting over stdio... ---")
     # This runs the server, communicating over standard input/output
     # It will wait for a client to connect.
-    mcp.run(transport="stdio")
\ No newline at end of file
+    mcp.run(transport="stdio")
@@ -1,11 +1,18 @@
 # ollama_client.py
+import os
 import ollama
 import json
+import time
 import asyncio
-from mcp import ClientSession, StdioServerParameters, types
-from mcp.client.stdio import stdio_client
+from mcp import types
+from chat_history import ChatHistory, tools_tokens
+from mcp_pool import MCPSessionPool, client_pool
 
 MODEL = "qwen3:latest" # Using one of the models you have. You need to use a model that accept tools. check ollama models for more
+MAX_CONCURRENT_TOOLS = 4  # tool calls running on the MCP server at the same time
+MAX_TOOL_ROUNDS = 5  # model requests that may ask for tools before it has to answer
+MAX_PROMPT_TOKENS = 4000  # older turns are compacted into a summary to stay below this
+STATS_FILE = "ollama_client_stats.json"  # prompt tokens and latency of every request, written on exit
 system_msg = {
         "role": "system",
         "content": (
@@ -18,94 +25,103 @@ system_msg = {
     }
 
 
-# This function connects to the MCP server to get the list of available tools
-async def get_mcp_tools(session: ClientSession) -> list:
-    """Fetches tools from the MCP server and formats them for Ollama."""
+# This function gets the list of available tools from the MCP server pool
+async def get_mcp_tools(pool: MCPSessionPool) -> list:
+    """Fetches tools from the MCP server and formats them for Ollama. The pool caches the formatted list
+    until the server announces that its tools changed."""
     print("--- Client: Fetching tools from MCP server... ---")
-    tool_list_response = await session.list_tools()
-    
-    ollama_tools = []
-    for tool in tool_list_response.tools:
-        ollama_tools.append({
-            'type': 'function',
-            'function': {
-                'name': tool.name,
-                'description': tool.description,
-                'parameters': tool.inputSchema,
-            },
-        })
-    print(f"--- Client: Loaded {len(ollama_tools)} tools. ---")
-    return ollama_tools
+    tools = await pool.tools()
+    print(f"--- Client: Loaded {len(tools)} tools. ---")
+    return tools
+
+
+async def call_tool(pool: MCPSessionPool, tool_call, limit: asyncio.Semaphore) -> dict:
+    """Executes one tool call on the MCP server and returns the tool message for Ollama."""
+    tool_name = tool_call['function']['name']
+    tool_args = tool_call['function']['arguments']
+    async with limit:
+        print(f"--- Client: Model wants to call '{tool_name}' with args: {tool_args} ---")
+        try:
+            result = await pool.call_tool(tool_name, arguments=tool_args)
+            # Extract the text content from the MCP tool result
+            tool_output = "\n".join(part.text for part in result.content if isinstance(part, types.TextContent))
+        except Exception as error:  # report the failure to the model instead of losing the other calls
+            tool_output = f"Error: {error}"
+    print(f"--- Client: Received tool output: '{tool_output[:100]}...' ---")
+    return {'role': 'tool', 'content': tool_output, 'tool_name': tool_name}
+
+
+async def request(client: ollama.AsyncClient, history: ChatHistory, **kwargs):
+    """Sends the history to Ollama and records the prompt size and the latency of the request."""
+    start = time.perf_counter()
+    response = await client.chat(model=MODEL, messages=history.messages(), **kwargs)
+    history.record_request(time.perf_counter() - start, response.get('prompt_eval_count'))
+    history.add(response['message'])
+    return response
+
+
+async def chat_with_tools(client: ollama.AsyncClient, pool: MCPSessionPool, history: ChatHistory, tools: list,
+                          limit: asyncio.Semaphore, max_rounds: int = MAX_TOOL_ROUNDS) -> str:
+    """Chats until the model answers without asking for tools and returns that answer."""
+    for _ in range(max_rounds):
+        # 1. Call Ollama with tools
+        response = await request(client, history, tools=tools)
+
+        # 2. Check if the model decided to use tools. If not, this is the answer
+        tool_calls = response['message'].get('tool_calls')
+        if not tool_calls:
+            return response['message']['content']
+
+        # 3. Execute all requested tool calls at the same time, at most MAX_CONCURRENT_TOOLS on the MCP server at once
+        tool_messages = await asyncio.gather(*(call_tool(pool, tool_call, limit) for tool_call in tool_calls))
+
+        # 4. Send the tool outputs back to Ollama, in the order of the calls, in the next round
+        for tool_message in tool_messages:
+            history.add(tool_message)
+
+    # Still asking for tools after max_rounds: ask for an answer without tools
+    final_response = await request(client, history)
+    return final_response['message']['content']
 
 
 async def main():
     """Main loop to run the Ollama client and interact with the MCP server."""
-    
-    # Define how to start our MCP server as a subprocess
-    server_params = StdioServerParameters(
-        command="python3",
-        args=["mcp_server.py"],
-    )
-
-    # Use the stdio_client to manage the server subprocess
-    async with stdio_client(server_params) as (read, write):
-        async with ClientSession(read, write) as session:
-            # Initialize the connection to the MCP server
-            await session.initialize()
-            
-            # Get the tool definitions from our running server
-            tools = await get_mcp_tools(session)
-
-            print("\nOllama MCP Client Initialized. How can I help?")
-            print("Model:", MODEL)
-            print("Type 'exit' to quit.")
-            
-            messages = []
-            
+
+    # Async client, so that waiting for the model does not block the event loop. host=None is the local
+    # Ollama server (or the OLLAMA_HOST environment variable); point it at a stub server for tests
+    client = ollama.AsyncClient(host=os.environ.get("OLLAMA_HOST"))
+    limit = asyncio.Semaphore(MAX_CONCURRENT_TOOLS)
+
+    # Connect to the shared pool service at MCP_POOL_URL (python mcp_pool.py --serve), whose servers are already
+    # warm, or start MCP_POOL_SIZE servers of our own; their sessions are shared by all tool calls of the chat
+    async with client_pool() as pool:
+        # Get the tool definitions from our running server
+        tools = await get_mcp_tools(pool)
+
+        print("\nOllama MCP Client Initialized. How can I help?")
+        print("Model:", MODEL)
+        print("Type 'exit' to quit.")
+        
+        # One system prompt for the whole conversation; the tool definitions are part of every prompt too
+        history = ChatHistory(system_msg['content'], MAX_PROMPT_TOKENS, reserved_tokens=tools_tokens(tools))
+
+        try:
             while True:
-                user_input = input("\n> ")
+                # input() waits in a thread, so the event loop keeps serving the MCP connection
+                user_input = await asyncio.to_thread(input, "\n> ")
                 if user_input.lower() == 'exit':
                     break
-                
-                messages.append(system_msg)
-                messages.append({'role': 'user', 'content': user_input},)
-
-                # 1. First call to Ollama with tools
-                response = ollama.chat(
-                    model=MODEL,
-                    messages=messages,
-                    tools=tools
-                )
-                messages.append(response['message'])
-                
-                # 2. Check if the model decided to use a tool
-                if response['message'].get('tool_calls'):
-                    tool_calls = response['message']['tool_calls']
-                    tool_call = tool_calls[0] # Handle one tool call for simplicity
-                    tool_name = tool_call['function']['name']
-                    tool_args = tool_call['function']['arguments']
-
-                    print(f"--- Client: Model wants to call '{tool_name}' with args: {tool_args} ---")
-
-                    # 3. Execute the tool by calling the MCP server
-                    result = await session.call_tool(tool_name, arguments=tool_args)
-                    
-                    # Extract the text content from the MCP tool result
-                    tool_output = ""
-                    if result.content and isinstance(result.content[0], types.TextContent):
-                        tool_output = result.content[0].text
-                    
-                    print(f"--- Client: Received tool output: '{tool_output[:100]}...' ---")
-
-                    # 4. Send the tool output back to Ollama
-                    messages.append({'role': 'tool', 'content': tool_output})
-                    final_response = ollama.chat(model=MODEL, messages=messages)
-                    
-                    print(f"\nAssistant:\n{final_response['message']['content']}")
-                    messages.append(final_response['message'])
-                else:
-                    # If no tool was called, just print the response
-                    print(f"\nAssistant:\n{response['message']['content']}")
+
+                history.start_turn(user_input)
+                # Cached by the pool, so this is cheap; it only asks the server again after the server
+                # announced that its tool list changed
+                tools = await pool.tools()
+                history.reserved_tokens = tools_tokens(tools)
+                answer = await chat_with_tools(client, pool, history, tools, limit)
+                print(f"\nAssistant:\n{answer}")
+        finally:
+            history.save_stats(STATS_FILE)
+            print(f"--- Client: MCP pool {pool.stats()} ---")
 
 
 if __name__ == "__main__":
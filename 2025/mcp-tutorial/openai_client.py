@@ -1,13 +1,18 @@
 import os
-import sys
 import json
+import time
 import asyncio
 from openai import AsyncOpenAI
-from mcp import ClientSession, StdioServerParameters, types
-from mcp.client.stdio import stdio_client
+from mcp import types
+from chat_history import ChatHistory, tools_tokens
+from mcp_pool import MCPSessionPool, client_pool
 
 # --- Configuration ---
 MODEL = "gpt-4o"  # Or "gpt-3.5-turbo" for a cheaper/faster option
+SYSTEM_PROMPT = "You have access to tools. When a tool result is provided, use it directly to answer the user's request."
+MAX_PROMPT_TOKENS = 8000  # older turns are compacted into a summary to stay below this
+STREAM = True  # print the answers token by token as they are generated
+STATS_FILE = "openai_client_stats.json"  # prompt tokens and latency of every request, written on exit
 
 def load_api_key(filepath="api-key") -> str | None:
     """Loads the OpenAI API key from a file."""
@@ -20,24 +25,113 @@ def load_api_key(filepath="api-key") -> str | None:
         return None
     return None
 
-# This function connects to the MCP server to get the list of available tools
-async def get_mcp_tools(session: ClientSession) -> list:
-    """Fetches tools from the MCP server and formats them for OpenAI."""
+# This function gets the list of available tools from the MCP server pool
+async def get_mcp_tools(pool: MCPSessionPool) -> list:
+    """Fetches tools from the MCP server and formats them for OpenAI. The pool caches the formatted list
+    until the server announces that its tools changed."""
     print("--- Client: Fetching tools from MCP server... ---")
-    tool_list_response = await session.list_tools()
-    
-    openai_tools = []
-    for tool in tool_list_response.tools:
-        openai_tools.append({
-            'type': 'function',
-            'function': {
-                'name': tool.name,
-                'description': tool.description,
-                'parameters': tool.inputSchema,
-            },
-        })
-    print(f"--- Client: Loaded {len(openai_tools)} tools. ---")
-    return openai_tools
+    tools = await pool.tools()
+    print(f"--- Client: Loaded {len(tools)} tools. ---")
+    return tools
+
+def tool_output_text(result) -> str:
+    """Extracts the text content from an MCP tool result."""
+    return "\n".join(part.text for part in result.content if isinstance(part, types.TextContent))
+
+async def execute_tool(pool: MCPSessionPool, tool_call_id: str, tool_name: str, arguments: str) -> dict:
+    """Executes one tool call on the MCP server and returns the tool message for OpenAI."""
+    try:
+        # Arguments are a JSON string, so we need to parse them
+        tool_args = json.loads(arguments or "{}")
+        print(f"--- Client: Model wants to call '{tool_name}' with args: {tool_args} ---")
+        tool_output = tool_output_text(await pool.call_tool(tool_name, arguments=tool_args))
+    except Exception as error:  # report the failure to the model, every tool call needs a result
+        tool_output = f"Error: {error}"
+    print(f"--- Client: Received tool output: '{tool_output[:100]}...' ---")
+    return {"role": "tool", "tool_call_id": tool_call_id, "name": tool_name, "content": tool_output}
+
+def arguments_complete(arguments: str) -> bool:
+    """A JSON object is complete once it parses: a cut-off object is never valid JSON."""
+    if not arguments.rstrip().endswith("}"):
+        return False
+    try:
+        return isinstance(json.loads(arguments), dict)
+    except json.JSONDecodeError:
+        return False
+
+async def request(client: AsyncOpenAI, pool: MCPSessionPool, history: ChatHistory, **kwargs):
+    """Sends the history to OpenAI, prints the answer and runs the tool calls the model asks for.
+    Returns the answer, the tool messages and when the first token of the answer was printed."""
+    start = time.perf_counter()
+    response = await client.chat.completions.create(model=MODEL, messages=history.messages(), **kwargs)
+    history.record_request(time.perf_counter() - start, response.usage.prompt_tokens if response.usage else None)
+    response_message = response.choices[0].message
+    history.add(response_message)  # Append the full message object
+
+    answer_started = None
+    if response_message.content:
+        answer_started = time.perf_counter()
+        print(f"\nAssistant:\n{response_message.content}")
+    tool_messages = await asyncio.gather(*(
+        execute_tool(pool, tool_call.id, tool_call.function.name, tool_call.function.arguments)
+        for tool_call in response_message.tool_calls or []))
+    return response_message.content, list(tool_messages), answer_started
+
+async def stream_request(client: AsyncOpenAI, pool: MCPSessionPool, history: ChatHistory, **kwargs):
+    """Like request, but prints the answer token by token as it is generated. Tool calls arrive as deltas:
+    the name and id first, then the arguments in pieces. Each call is sent to the MCP server as soon as its
+    arguments are complete, while the model is still generating the next ones."""
+    start = time.perf_counter()
+    first_token = answer_started = None
+    prompt_tokens = None
+    content = []
+    calls = {}  # index -> {'id', 'name', 'arguments'}
+    tasks = {}  # index -> task running the tool call
+
+    stream = await client.chat.completions.create(model=MODEL, messages=history.messages(), stream=True,
+                                                  stream_options={"include_usage": True}, **kwargs)
+    async for chunk in stream:
+        if chunk.usage:  # the last chunk only has the usage
+            prompt_tokens = chunk.usage.prompt_tokens
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if first_token is None and (delta.content or delta.tool_calls):
+            first_token = time.perf_counter() - start
+        if delta.content:
+            if answer_started is None:
+                answer_started = time.perf_counter()
+                print("\nAssistant:")
+            print(delta.content, end="", flush=True)
+            content.append(delta.content)
+        for part in delta.tool_calls or []:
+            call = calls.setdefault(part.index, {'id': None, 'name': '', 'arguments': ''})
+            if part.id:
+                call['id'] = part.id
+            if part.function and part.function.name:
+                call['name'] += part.function.name
+            if part.function and part.function.arguments:
+                call['arguments'] += part.function.arguments
+            if part.index not in tasks and arguments_complete(call['arguments']):
+                tasks[part.index] = asyncio.create_task(
+                    execute_tool(pool, call['id'], call['name'], call['arguments']))
+    if content:
+        print()
+    history.record_request(time.perf_counter() - start, prompt_tokens, first_token)
+
+    # Calls whose arguments never became a valid object are run now, execute_tool reports the error
+    for index, call in calls.items():
+        if index not in tasks:
+            tasks[index] = asyncio.create_task(execute_tool(pool, call['id'], call['name'], call['arguments']))
+
+    message = {"role": "assistant", "content": "".join(content) or None}
+    if calls:
+        message["tool_calls"] = [{"id": call['id'], "type": "function",
+                                  "function": {"name": call['name'], "arguments": call['arguments']}}
+                                 for _, call in sorted(calls.items())]
+    history.add(message)
+    tool_messages = [await tasks[index] for index in sorted(tasks)]
+    return message["content"], tool_messages, answer_started
 
 async def main():
     """Main loop to run the OpenAI client and interact with the MCP server."""
@@ -51,88 +145,50 @@ async def main():
     # Initialize the Async OpenAI client
     client = AsyncOpenAI(api_key=api_key)
 
-    # Define how to start our MCP server as a subprocess
-    server_params = StdioServerParameters(
-        # Use sys.executable to ensure the subprocess uses the same python
-        command=sys.executable,
-        args=["mcp_server.py"],
-    )
-
-    # Use the stdio_client to manage the server subprocess
-    async with stdio_client(server_params) as (read, write):
-        async with ClientSession(read, write) as session:
-            # Initialize the connection to the MCP server
-            await session.initialize()
-            
-            # Get the tool definitions from our running server
-            tools = await get_mcp_tools(session)
-
-            print("\nOpenAI MCP Client Initialized. How can I help?")
-            print("Model:", MODEL)
-            print("Type 'exit' to quit.")
-            
-            messages = []
-            
+    # Connect to the shared pool service at MCP_POOL_URL (python mcp_pool.py --serve), whose servers are already
+    # warm, or start MCP_POOL_SIZE servers of our own; their sessions are shared by all tool calls of the chat
+    async with client_pool() as pool:
+        # Get the tool definitions from our running server
+        tools = await get_mcp_tools(pool)
+
+        print("\nOpenAI MCP Client Initialized. How can I help?")
+        print("Model:", MODEL)
+        print("Type 'exit' to quit.")
+        
+        # One system prompt for the whole conversation; the tool definitions are part of every prompt too
+        history = ChatHistory(SYSTEM_PROMPT, MAX_PROMPT_TOKENS, reserved_tokens=tools_tokens(tools))
+
+        try:
             while True:
-                user_input = input("\n> ")
+                # input() waits in a thread, so the event loop keeps serving the MCP connection
+                user_input = await asyncio.to_thread(input, "\n> ")
                 if user_input.lower() == 'exit':
                     break
-                
-                messages.append({'role': 'user', 'content': user_input})
+
+                history.start_turn(user_input)
+                # Cached by the pool, so this is cheap; it only asks the server again after the server
+                # announced that its tool list changed
+                tools = await pool.tools()
+                history.reserved_tokens = tools_tokens(tools)
+                turn_start = time.perf_counter()
+                ask = stream_request if STREAM else request
 
                 # 1. First call to OpenAI with tools
-                response = await client.chat.completions.create(
-                    model=MODEL,
-                    messages=messages,
-                    tools=tools,
-                    tool_choice="auto"
-                )
-                
-                response_message = response.choices[0].message
-                messages.append(response_message) # Append the full message object
-                
-                # 2. Check if the model decided to use a tool
-                if response_message.tool_calls:
-                    tool_calls = response_message.tool_calls
-                    
-                    # For this example, we handle one tool call, but you could loop here
-                    tool_call = tool_calls[0]
-                    tool_name = tool_call.function.name
-                    # Arguments are a JSON string, so we need to parse them
-                    tool_args = json.loads(tool_call.function.arguments)
-
-                    print(f"--- Client: Model wants to call '{tool_name}' with args: {tool_args} ---")
-
-                    # 3. Execute the tool by calling the MCP server
-                    result = await session.call_tool(tool_name, arguments=tool_args)
-                    
-                    # Extract the text content from the MCP tool result
-                    tool_output = ""
-                    if result.content and isinstance(result.content[0], types.TextContent):
-                        tool_output = result.content[0].text
-                    
-                    print(f"--- Client: Received tool output: '{tool_output[:100]}...' ---")
-
-                    # 4. Send the tool output back to OpenAI
-                    messages.append({
-                        "role": "tool",
-                        "tool_call_id": tool_call.id,
-                        "name": tool_name,
-                        "content": tool_output,
-                    })
-                    
-                    final_response = await client.chat.completions.create(
-                        model=MODEL,
-                        messages=messages,
-                    )
-                    
-                    final_message = final_response.choices[0].message.content
-                    print(f"\nAssistant:\n{final_message}")
-                    messages.append(final_response.choices[0].message)
-                else:
-                    # If no tool was called, just print the response
-                    assistant_message = response_message.content
-                    print(f"\nAssistant:\n{assistant_message}")
+                # 2. If the model decided to use tools, 3. they are executed on the MCP server right away
+                _, tool_messages, answer_started = await ask(client, pool, history,
+                                                             tools=tools, tool_choice="auto")
+                if tool_messages:
+                    # 4. Send the tool outputs back to OpenAI. Every tool call needs its result in the
+                    # history, otherwise OpenAI rejects the next request
+                    for tool_message in tool_messages:
+                        history.add(tool_message)
+                    _, _, answer_started = await ask(client, pool, history)
+
+                history.record_turn(time.perf_counter() - turn_start,
+                                    answer_started - turn_start if answer_started else None)
+        finally:
+            history.save_stats(STATS_FILE)
+            print(f"--- Client: MCP pool {pool.stats()} ---")
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,292 @@
+#Scaling benchmarks for the day_one scripts: tokenizer.py, lan_identifier.py, the HMM tagger of hmm_nltk.py and the
+#TF-IDF + random forest pipeline of sklearn_randomforest.py.
+#The corpora are built from the bundled english.txt and sentences.txt at every --scales factor: copy 0 is the
+#original file and every further copy has its lines in a different order, drawn with --seed. The vocabulary therefore
+#stays that of the bundled files while the amount of text grows, and every run on the same version gives the same data.
+#
+#Every benchmark and scale runs in a fresh process, so each memory figure belongs to a single case. It is the peak
+#resident memory minus the resident memory after the imports (numpy, sklearn, nltk), i.e. what the workload adds.
+#Every timed step is repeated until it has run for --min-time seconds, and every single call of the latency samples
+#until --min-call-time, so the fast cases at small scales are measured above the noise of the clock.
+#For every case the JSON results hold the items processed, throughput (items/sec), latency percentiles of single
+#calls (one line, one sentence or one review) where that makes sense, and the memory growth.
+#The HMM tagger is timed twice: hmm_tag_nltk is the tag method of the NLTK tagger, hmm_tag_arrays the ArrayHMMTagger
+#of hmm_arrays.py that it is exported to.
+#Pass the results of an earlier version as --baseline to list the cases whose throughput dropped.
+#
+#The sentiment pipeline has no review data in the repo, so it classifies the language of the sentences.txt lines.
+#It does not use CachedVectorizer, since cached fits would measure the disk cache instead of TF-IDF.
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import re
+import subprocess
+import time
+from datetime import datetime, timezone
+
+import nltk
+import numpy as np
+import sklearn
+from nltk import HiddenMarkovModelTagger as hmm
+from nltk import RegexpTagger
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.pipeline import Pipeline
+
+from evaluation import current_memory_mb, peak_memory_mb
+from hmm_arrays import ArrayHMMTagger, hmm_to_arrays
+from lan_identifier import LANGUAGES, NGRAM_SIZES, calculate_score, get_top_ngrams, normalize
+from tokenizer import tokenize_text
+
+SCALES = (1, 10, 100, 1000)
+PERCENTILES = (50, 90, 99)
+
+# Offline stand-in for a POS tagged corpus: the english.txt sentences tagged by suffix and word list rules
+TAG_PATTERNS = [
+    (r'^[^\w\s]+$', '.'),
+    (r'^-?\d+([.,]\d+)?$', 'CD'),
+    (r'(?i)^(the|a|an|this|that|these|those)$', 'DT'),
+    (r'(?i)^(in|on|at|of|to|from|by|with|for|into|than)$', 'IN'),
+    (r'(?i)^(and|or|but)$', 'CC'),
+    (r'(?i)^(it|its|he|she|they|we|i|you|their|his|her)$', 'PRP'),
+    (r'(?i)^(is|are|was|were|be|been|has|have|had)$', 'VB'),
+    (r'^[A-Z]', 'NNP'),
+    (r'.*ing$', 'VBG'),
+    (r'.*ed$', 'VBD'),
+    (r'.*ly$', 'RB'),
+    (r'.*s$', 'NNS'),
+    (r'.*', 'NN'),
+]
+SENTENCE_END = re.compile(r'^[.!?]$')
+
+def write_corpus(source, target, scale, seed, encoding='utf-8'):
+    # Write scale copies of the non-empty lines of source to target (utf-8)
+    with open(source, 'r', encoding=encoding) as f:
+        lines = [line.rstrip('\n') for line in f if line.strip()]
+    rng = random.Random(seed)
+    with open(target, 'w', encoding='utf-8') as out:
+        for copy in range(scale):
+            if copy:
+                rng.shuffle(lines)
+            for line in lines:
+                out.write(line + '\n')
+
+def build_corpora(directory, scales, seed):
+    os.makedirs(directory, exist_ok=True)
+    corpora = {}
+    for scale in scales:
+        english = os.path.join(directory, f'english_x{scale}.txt')
+        sentences = os.path.join(directory, f'sentences_x{scale}.txt')
+        write_corpus('english.txt', english, scale, seed)
+        write_corpus('sentences.txt', sentences, scale, seed, encoding='latin-1')  # sentences.txt is latin-1
+        corpora[scale] = {'english': english, 'sentences': sentences}
+    return corpora
+
+def read_lines(filename):
+    with open(filename, 'r', encoding='utf-8') as f:
+        return [line.rstrip('\n') for line in f]
+
+def read_labelled(filename):
+    texts, labels = [], []
+    for line in read_lines(filename):
+        text, label = line.rsplit(',', 1)
+        texts.append(text)
+        labels.append(label)
+    return texts, labels
+
+def tagged_sentences(filename):
+    # Split the lines into token lists with tokenize_text, then into sentences, and tag them with TAG_PATTERNS
+    tagger = RegexpTagger(TAG_PATTERNS)
+    sentences = []
+    for line in read_lines(filename):
+        sentence = []
+        for token in tokenize_text(line).split('\n'):
+            if token:
+                sentence.append(token)
+                if SENTENCE_END.match(token):
+                    sentences.append(sentence)
+                    sentence = []
+        if sentence:
+            sentences.append(sentence)
+    return tagger.tag_sents(sentences)
+
+def sample(items, count, seed):
+    return random.Random(seed).sample(items, min(count, len(items)))
+
+def timed(function, min_time):
+    # Seconds per call of function(), called again and again until min_time has passed
+    runs = 0
+    start = time.perf_counter()
+    while True:
+        function()
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return elapsed / runs
+
+def time_calls(function, items, min_time):
+    # Latency of calling function on every item, in seconds
+    return [timed(lambda: function(item), min_time) for item in items]
+
+def result(name, items, unit, seconds, latencies=None):
+    return {'benchmark': name, 'items': items, 'unit': unit, 'seconds': seconds, 'latencies': latencies}
+
+# Every benchmark function takes the corpora of one scale and the arguments and returns a list of results
+
+def bench_tokenize(corpus, args):
+    with open(corpus['english'], 'r', encoding='utf-8') as f:
+        text = f.read()
+    seconds = timed(lambda: tokenize_text(text), args.min_time)
+    lines = sample(text.splitlines(), args.latency_samples, args.seed)
+    return [result('tokenize_text', len(text), 'characters', seconds,
+                   time_calls(tokenize_text, lines, args.min_call_time))]
+
+def bench_ngrams(corpus, args):
+    # Profiles as in the original lan_identifier.py: the top n-grams of each language, then
+    # calculate_score of every language and n-gram size for each normalized sentence
+    with open(corpus['english'], 'r', encoding='utf-8') as f:
+        characters = len(f.read())
+    profile_seconds = timed(lambda: [get_top_ngrams(corpus['english'], n) for n in NGRAM_SIZES], args.min_time)
+    profile_latencies = time_calls(lambda n: get_top_ngrams(corpus['english'], n), NGRAM_SIZES, args.min_call_time)
+
+    profiles = {lang: {n: get_top_ngrams(filename, n) for n in NGRAM_SIZES} for lang, filename in LANGUAGES.items()}
+    def detect(sentence):
+        sentence = normalize(sentence)
+        scores = {lang: sum(calculate_score(sentence, profile[n], n) for n in NGRAM_SIZES)
+                  for lang, profile in profiles.items()}
+        return max(scores, key=scores.get)
+
+    sentences, _ = read_labelled(corpus['sentences'])
+    score_seconds = timed(lambda: [detect(sentence) for sentence in sentences], args.min_time)
+    latencies = time_calls(detect, sample(sentences, args.latency_samples, args.seed), args.min_call_time)
+    return [result('get_top_ngrams', characters * len(NGRAM_SIZES), 'characters', profile_seconds, profile_latencies),
+            result('calculate_score', len(sentences), 'sentences', score_seconds, latencies)]
+
+def bench_hmm(corpus, args):
+    tagged = tagged_sentences(corpus['english'])
+    tokens = sum(len(sent) for sent in tagged)
+    train_seconds = timed(lambda: hmm.train(tagged), args.min_time)
+    tagger = hmm.train(tagged)
+
+    sentences = [[word for word, _ in sent] for sent in tagged]
+    samples = sample(sentences, args.latency_samples, args.seed)
+    results = [result('hmm_train', tokens, 'tokens', train_seconds)]
+    for name, tag in (('hmm_tag_nltk', tagger), ('hmm_tag_arrays', ArrayHMMTagger(*hmm_to_arrays(tagger)))):
+        seconds = timed(lambda: [tag.tag(sentence) for sentence in sentences], args.min_time)
+        results.append(result(name, tokens, 'tokens', seconds, time_calls(tag.tag, samples, args.min_call_time)))
+    return results
+
+def bench_sentiment(corpus, args):
+    texts, labels = read_labelled(corpus['sentences'])
+    order = random.Random(args.seed).sample(range(len(texts)), len(texts))
+    test = set(order[:max(1, len(texts) // 10)])
+    X_train = [text for i, text in enumerate(texts) if i not in test]
+    y_train = [label for i, label in enumerate(labels) if i not in test]
+    X_test = [texts[i] for i in sorted(test)]
+
+    pipeline = Pipeline([
+        ('tfidf', TfidfVectorizer(stop_words='english')),
+        ('clf', RandomForestClassifier(n_estimators=args.trees, random_state=42))
+    ])
+    train_seconds = timed(lambda: pipeline.fit(X_train, y_train), args.min_time)
+    predict_seconds = timed(lambda: pipeline.predict(X_test), args.min_time)
+    latencies = time_calls(lambda text: pipeline.predict([text]), sample(X_test, args.latency_samples, args.seed),
+                           args.min_call_time)
+    return [result('pipeline_fit', len(X_train), 'texts', train_seconds),
+            result('pipeline_predict', len(X_test), 'texts', predict_seconds, latencies)]
+
+BENCHMARKS = {'tokenize': bench_tokenize, 'ngrams': bench_ngrams, 'hmm': bench_hmm, 'sentiment': bench_sentiment}
+
+def run_case(name, scale, corpus, args):
+    # Run one benchmark at one scale in this (fresh) process and summarize its results. The memory figure is
+    # the growth of the peak over the resident memory before the benchmark, after all imports
+    before = current_memory_mb()
+    results = BENCHMARKS[name](corpus, args)
+    peak, _ = peak_memory_mb()
+    growth = peak - before if peak is not None and before is not None else None
+    summaries = []
+    for entry in results:
+        latencies = entry.pop('latencies')
+        entry.update({'scale': scale, 'throughput': entry['items'] / entry['seconds'] if entry['seconds'] else None,
+                      'latency_ms': None, 'memory_mb': growth})
+        if latencies:
+            values = np.percentile(np.array(latencies) * 1000, PERCENTILES)
+            entry['latency_ms'] = {f'p{p}': float(value) for p, value in zip(PERCENTILES, values)}
+        summaries.append(entry)
+    return summaries
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'numpy': np.__version__, 'scikit-learn': sklearn.__version__, 'nltk': nltk.__version__, 'commit': commit}
+
+def compare(results, baseline_file, tolerance):
+    # Print the cases whose throughput is more than tolerance below the baseline run
+    with open(baseline_file, 'r') as f:
+        baseline = {(row['benchmark'], row['scale']): row for row in json.load(f)['results']}
+    regressions = 0
+    for row in results:
+        old = baseline.get((row['benchmark'], row['scale']))
+        if old is None or not old['throughput'] or row['throughput'] is None:
+            continue
+        ratio = row['throughput'] / old['throughput']
+        if ratio < 1 - tolerance:
+            regressions += 1
+            print(f"REGRESSION {row['benchmark']} x{row['scale']}: {ratio:.2f} times the baseline throughput")
+    print(f"{regressions} regression(s) against {baseline_file}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the day_one scripts on synthetic corpora of growing size.')
+    parser.add_argument('--scales', type=int, nargs='+', default=list(SCALES),
+                        help='multiples of english.txt and sentences.txt to run at')
+    parser.add_argument('--benchmarks', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--latency-samples', type=int, default=200, help='single calls timed for the latency percentiles')
+    parser.add_argument('--min-time', type=float, default=0.5, help='seconds every timed step is repeated for')
+    parser.add_argument('--min-call-time', type=float, default=0.001,
+                        help='seconds every single call of the latency samples is repeated for')
+    parser.add_argument('--trees', type=int, default=100, help='trees of the random forest')
+    parser.add_argument('--data-dir', default='benchmark_data', help='where the synthetic corpora are written')
+    parser.add_argument('--out', default='benchmark_results.json')
+    parser.add_argument('--baseline', help='results of an earlier run to compare the throughput with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='throughput drop reported as a regression')
+    args = parser.parse_args()
+
+    corpora = build_corpora(args.data_dir, args.scales, args.seed)
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for name in args.benchmarks:
+        for scale in args.scales:
+            with context.Pool(1) as pool:
+                summaries = pool.apply(run_case, (name, scale, corpora[scale], args))
+            for row in summaries:
+                latency = ' '.join(f"{key} {value:.3f}" for key, value in row['latency_ms'].items()) \
+                    if row['latency_ms'] else '-'
+                memory = f"+{row['memory_mb']:.1f} MB" if row['memory_mb'] is not None else 'n/a'
+                # No throughput when a case was too fast for the clock
+                throughput = f"{row['throughput']:14,.0f}/s" if row['throughput'] is not None else f"{'n/a':>16}"
+                print(f"{row['benchmark']:>16} x{scale:<5} {row['items']:>11} {row['unit']:<10} "
+                      f"{throughput}  latency ms: {latency}  memory {memory}")
+            results.extend(summaries)
+
+    report = {'created': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'environment': environment(),
+              'settings': {'scales': args.scales, 'seed': args.seed, 'latency_samples': args.latency_samples,
+                           'min_time': args.min_time, 'min_call_time': args.min_call_time, 'trees': args.trees},
+              'results': results}
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.out}")
+
+    if args.baseline:
+        compare(results, args.baseline, args.tolerance)
+
+if __name__ == "__main__":
+    main()
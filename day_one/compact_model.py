@@ -0,0 +1,220 @@
+#Compact, fast-loading artifacts for the sentiment model of sklearn_randomforest.py.
+#joblib.load of tfidf_vectorizer.pkl has to rebuild the vocabulary_ dict term by term, and random_forest_model.pkl
+#holds 100 separate tree objects. The export below writes both as flat NumPy arrays instead:
+#
+#   term_bytes.npy     sorted vocabulary as UTF-8, all terms in one byte buffer
+#   term_offsets.npy   start of every sorted term in term_bytes, and the end of the last one
+#   term_prefixes.npy  first PREFIX_BYTES bytes of every sorted term, looked up with np.searchsorted; a long
+#                      token is checked against the full term in term_bytes
+#   term_columns.npy   feature column of every sorted term
+#   idf.npy            idf weights of the TfidfVectorizer
+#   vectorizer.joblib  the vectorizer settings only (an unfitted clone, without vocabulary)
+#   feature/threshold/left/right/values.npy
+#                      the nodes of all trees one after the other, children as global node numbers
+#   roots.npy          first node of every tree
+#   classes.json       class labels
+#
+#All .npy files are memory-mapped by load_compact. Predictions follow the arithmetic of TfidfVectorizer.transform
+#and RandomForestClassifier.predict, so they are identical to the joblib models.
+#Run this file to export the models and benchmark startup time and memory against joblib.load.
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+
+import joblib
+import numpy as np
+from scipy import sparse
+from sklearn.base import clone
+from sklearn.preprocessing import normalize
+
+from evaluation import current_memory_mb
+
+PREFIX_BYTES = 16  # width of the prefix table; one very long term does not make every entry as wide
+
+def export_compact(vectorizer, forest, directory):
+    os.makedirs(directory, exist_ok=True)
+
+    # Vocabulary as a sorted byte buffer with offsets, and a fixed-width table of the term prefixes
+    encoded = sorted((term.encode('utf-8'), column) for term, column in vectorizer.vocabulary_.items())
+    lengths = np.array([len(term) for term, _ in encoded], dtype=np.int64)
+    np.save(os.path.join(directory, 'term_bytes.npy'),
+            np.frombuffer(b''.join(term for term, _ in encoded), dtype=np.uint8))
+    np.save(os.path.join(directory, 'term_offsets.npy'), np.concatenate([[0], np.cumsum(lengths)]))
+    np.save(os.path.join(directory, 'term_prefixes.npy'),
+            np.array([term[:PREFIX_BYTES] for term, _ in encoded], dtype=f'S{PREFIX_BYTES}'))
+    np.save(os.path.join(directory, 'term_columns.npy'), np.array([column for _, column in encoded], dtype=np.int64))
+    np.save(os.path.join(directory, 'idf.npy'), np.asarray(vectorizer.idf_, dtype=np.float64))
+    settings = clone(vectorizer)
+    settings.vocabulary = None
+    joblib.dump(settings, os.path.join(directory, 'vectorizer.joblib'))
+
+    # All trees packed into flat node arrays
+    roots, feature, threshold, left, right, values = [], [], [], [], [], []
+    offset = 0
+    for estimator in forest.estimators_:
+        tree = estimator.tree_
+        roots.append(offset)
+        feature.append(tree.feature)
+        threshold.append(tree.threshold)
+        left.append(np.where(tree.children_left >= 0, tree.children_left + offset, -1))
+        right.append(np.where(tree.children_right >= 0, tree.children_right + offset, -1))
+        value = np.array(tree.value[:, 0, :], dtype=np.float64)
+        # Older scikit-learn versions store class counts in the leaves and divide at predict time
+        totals = value.sum(axis=1, keepdims=True)
+        counts = np.abs(totals - 1) > 1e-6
+        value = np.where(counts & (totals > 0), value / np.where(totals > 0, totals, 1), value)
+        values.append(value)
+        offset += tree.node_count
+    for name, parts, dtype in (('feature', feature, np.int32), ('threshold', threshold, np.float64),
+                               ('left', left, np.int32), ('right', right, np.int32), ('values', values, np.float64)):
+        np.save(os.path.join(directory, f'{name}.npy'), np.concatenate(parts).astype(dtype))
+    np.save(os.path.join(directory, 'roots.npy'), np.array(roots, dtype=np.int32))
+    with open(os.path.join(directory, 'classes.json'), 'w') as f:
+        json.dump(forest.classes_.tolist(), f)
+
+class CompactSentimentModel:
+    def __init__(self, directory):
+        load = lambda name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')
+        self.term_bytes, self.term_offsets = load('term_bytes'), load('term_offsets')
+        self.term_prefixes = load('term_prefixes')
+        self.term_columns = load('term_columns')
+        self.idf = load('idf')
+        self.settings = joblib.load(os.path.join(directory, 'vectorizer.joblib'))
+        self.analyzer = self.settings.build_analyzer()
+        self.feature, self.threshold = load('feature'), load('threshold')
+        self.left, self.right = load('left'), load('right')
+        self.values, self.roots = load('values'), load('roots')
+        with open(os.path.join(directory, 'classes.json'), 'r') as f:
+            self.classes = np.array(json.load(f))
+
+    def transform(self, texts):
+        # Same matrix as the fitted TfidfVectorizer.transform
+        rows, tokens = [], []
+        for i, text in enumerate(texts):
+            doc_tokens = [token.encode('utf-8') for token in self.analyzer(text)]
+            tokens.extend(doc_tokens)
+            rows.extend([i] * len(doc_tokens))
+        positions, known = self._lookup(tokens)
+        counts = sparse.csr_matrix(
+            (np.ones(int(known.sum())), (np.array(rows, dtype=np.int64)[known], self.term_columns[positions[known]])),
+            shape=(len(texts), len(self.idf)), dtype=self.settings.dtype)
+        counts.sum_duplicates()
+        if self.settings.binary:
+            counts.data.fill(1)
+        matrix = counts.astype(np.float64)
+        if self.settings.sublinear_tf:
+            np.log(matrix.data, matrix.data)
+            matrix.data += 1.0
+        if self.settings.use_idf:
+            matrix.data *= self.idf[matrix.indices]
+        if self.settings.norm is not None:
+            matrix = normalize(matrix, norm=self.settings.norm, copy=False)
+        return matrix
+
+    def _lookup(self, tokens):
+        # Position of every token in the sorted vocabulary, and whether it is in the vocabulary at all.
+        # A token shorter than PREFIX_BYTES is found when its prefix is; only a term of at least PREFIX_BYTES
+        # bytes can share its prefix with other terms, so longer tokens are compared with the full terms
+        queries = np.array(tokens, dtype=self.term_prefixes.dtype) if tokens else np.zeros(0, self.term_prefixes.dtype)
+        positions = np.searchsorted(self.term_prefixes, queries, side='left')
+        ends = np.searchsorted(self.term_prefixes, queries, side='right')
+        long_tokens = np.array([len(token) >= PREFIX_BYTES for token in tokens], dtype=bool)
+        known = (ends > positions) & ~long_tokens
+        for i in np.flatnonzero((ends > positions) & long_tokens):
+            token = tokens[i]
+            for position in range(positions[i], ends[i]):
+                start, end = self.term_offsets[position], self.term_offsets[position + 1]
+                if end - start == len(token) and self.term_bytes[start:end].tobytes() == token:
+                    positions[i], known[i] = position, True
+                    break
+        return np.minimum(positions, len(self.term_prefixes) - 1), known
+
+    def predict_proba_features(self, matrix, batch_size=256):
+        # Walk all trees for a batch of rows at once; a node is a leaf when it has no left child. The feature
+        # values are read from the CSR arrays: every stored value has the key row * columns + column, in
+        # sorted order, so the value of a (row, feature) pair is found with np.searchsorted, and is 0 if absent
+        matrix = sparse.csr_matrix(matrix, dtype=np.float32)
+        if not matrix.has_canonical_format:  # sorted columns in every row, no duplicates
+            matrix = matrix.copy()
+            matrix.sum_duplicates()
+        columns = np.int64(matrix.shape[1])
+        keys = np.repeat(np.arange(matrix.shape[0], dtype=np.int64), np.diff(matrix.indptr)) * columns + matrix.indices
+        missing = len(keys)
+        keys = np.append(keys, -1)  # a pair that is not stored ends up at this position, with the value 0
+        data = np.append(matrix.data, np.float32(0))
+        proba = np.zeros((matrix.shape[0], self.values.shape[1]))
+        for start in range(0, matrix.shape[0], batch_size):
+            rows = np.arange(start, min(start + batch_size, matrix.shape[0]), dtype=np.int64)[:, None]
+            nodes = np.broadcast_to(self.roots, (len(rows), len(self.roots))).copy()
+            while True:
+                inner = self.left[nodes] >= 0
+                if not inner.any():
+                    break
+                wanted = rows * columns + np.where(inner, self.feature[nodes], 0)
+                found = np.searchsorted(keys[:missing], wanted)
+                found[keys[found] != wanted] = missing
+                goes_left = data[found] <= self.threshold[nodes]
+                nodes = np.where(inner, np.where(goes_left, self.left[nodes], self.right[nodes]), nodes)
+            batch = proba[start:start + batch_size]
+            for tree in range(len(self.roots)):  # summed tree by tree in order, like the forest does
+                batch += self.values[nodes[:, tree]]
+        proba /= len(self.roots)
+        return proba
+
+    def predict_proba(self, texts):
+        return self.predict_proba_features(self.transform(texts))
+
+    def predict(self, texts):
+        return self.classes.take(np.argmax(self.predict_proba(texts), axis=1), axis=0)
+
+def load_compact(directory):
+    return CompactSentimentModel(directory)
+
+def measure_startup(kind, args):
+    # Load one kind of model in a fresh process and classify one sentence. The memory figure is the growth of
+    # the resident memory, since the imports of this module already take the same memory in both processes.
+    before = current_memory_mb()
+    start = time.perf_counter()
+    if kind == 'joblib':
+        clf = joblib.load(args.model)
+        vectorizer = joblib.load(args.vectorizer)
+        predict = lambda texts: clf.predict(vectorizer.transform(texts))
+    else:
+        predict = load_compact(args.out).predict
+    load_time = time.perf_counter() - start
+    predict(['This movie was great'])
+    first_prediction = time.perf_counter() - start
+    after = current_memory_mb()
+    return load_time, first_prediction, after - before if after is not None else None
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the random forest and TF-IDF vectorizer as compact arrays.')
+    parser.add_argument('--model', default='random_forest_model.pkl')
+    parser.add_argument('--vectorizer', default='tfidf_vectorizer.pkl')
+    parser.add_argument('--out', default='compact_model')
+    parser.add_argument('--data', default='train_data.json', help='reviews used to check that predictions match')
+    parser.add_argument('--check', type=int, default=1000, help='number of reviews to compare')
+    args = parser.parse_args()
+
+    clf = joblib.load(args.model)
+    vectorizer = joblib.load(args.vectorizer)
+    export_compact(vectorizer, clf, args.out)
+
+    with open(args.data, 'r') as f:
+        texts = [row['text'] for row in json.load(f)[:args.check]]
+    same = np.array_equal(clf.predict(vectorizer.transform(texts)), load_compact(args.out).predict(texts))
+    print(f"Identical predictions on {len(texts)} reviews: {same}")
+
+    context = multiprocessing.get_context('spawn')
+    for kind in ('joblib', 'compact'):
+        with context.Pool(1) as pool:
+            load_time, first_prediction, memory = pool.apply(measure_startup, (kind, args))
+        memory = f"{memory:.1f} MB" if memory is not None else 'n/a'
+        print(f"{kind:>8}: load {load_time * 1000:8.1f} ms, first prediction after {first_prediction * 1000:8.1f} ms, "
+              f"memory growth {memory}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# Confusion matrix shared by the day_one scripts (hmm_nltk.py, lan_identifier.py, sklearn_randomforest.py).
+# Labels are mapped to integers and a batch of (true, predicted) pairs is counted in one np.bincount,
+# so the cost is linear in the number of predictions however many labels there are. Batches can be
+# added one after the other, and matrices counted in different processes can be merged.
+# peak_memory_mb and current_memory_mb give the memory figures the benchmarks report next to their throughput.
+
+import os
+
+import numpy as np
+
+try:
+    import resource  # peak memory figures, not available on Windows
+except ImportError:
+    resource = None
+
+class ConfusionMatrix:
+    # matrix[i, j] counts the predictions of label j for items whose true label is i
+
+    def __init__(self, labels=()):
+        self.labels = []
+        self.index = {}
+        self.matrix = np.zeros((0, 0), dtype=np.int64)
+        self.add_labels(labels)
+
+    def add_labels(self, labels):
+        new = [label for label in dict.fromkeys(labels) if label not in self.index]
+        for label in new:
+            self.index[label] = len(self.labels)
+            self.labels.append(label)
+        if new:
+            self.matrix = np.pad(self.matrix, (0, len(new)))
+        return self
+
+    def update(self, true_ids, predicted_ids):
+        # Count a batch of label integers (indexes into self.labels). An id outside the labels would
+        # be counted in another cell of the matrix, so it is an error, as are batches of different lengths
+        k = len(self.labels)
+        true_ids = np.asarray(true_ids, dtype=np.int64)
+        predicted_ids = np.asarray(predicted_ids, dtype=np.int64)
+        if true_ids.shape != predicted_ids.shape:
+            raise ValueError(f"{true_ids.size} true labels but {predicted_ids.size} predictions")
+        ids = np.concatenate([true_ids.ravel(), predicted_ids.ravel()])
+        if len(ids) and (ids.min() < 0 or ids.max() >= k):
+            raise ValueError(f"unknown label id {ids.min() if ids.min() < 0 else ids.max()}, "
+                             f"the matrix has {k} labels; add it with add_labels first")
+        pairs = true_ids * k + predicted_ids
+        self.matrix += np.bincount(pairs, minlength=k * k).reshape(k, k)
+        return self
+
+    def update_labels(self, true_labels, predicted_labels):
+        # Count a batch of labels; labels that were not seen before are added in sorted order
+        true_labels = np.asarray(true_labels)
+        values, inverse = np.unique(np.concatenate([true_labels, np.asarray(predicted_labels)]), return_inverse=True)
+        self.add_labels(values.tolist())
+        ids = np.array([self.index[value] for value in values.tolist()], dtype=np.int64)[inverse.ravel()]
+        return self.update(ids[:len(true_labels)], ids[len(true_labels):])
+
+    def merge(self, other):
+        self.add_labels(other.labels)
+        ids = [self.index[label] for label in other.labels]
+        self.matrix[np.ix_(ids, ids)] += other.matrix
+        return self
+
+    def correct(self):
+        return np.diag(self.matrix)
+
+    def support(self):
+        return self.matrix.sum(axis=1)
+
+    def predicted(self):
+        return self.matrix.sum(axis=0)
+
+    def total(self):
+        return int(self.matrix.sum())
+
+    def accuracy(self):
+        return self.correct().sum() / self.total() if self.total() else 0.0
+
+    def precision(self):
+        return _ratio(self.correct(), self.predicted())
+
+    def recall(self):
+        # Share of the occurrences of a label that were predicted correctly
+        return _ratio(self.correct(), self.support())
+
+    def f1(self):
+        # Harmonic mean of the precision and the recall of every label
+        precision, recall = self.precision(), self.recall()
+        return _ratio(2 * precision * recall, precision + recall)
+
+    def label_accuracy(self):
+        # One-vs-rest accuracy of every label: (true positives + true negatives) / total
+        wrong = self.support() + self.predicted() - 2 * self.correct()
+        return _ratio(self.total() - wrong, np.full(len(self.labels), self.total()))
+
+    def report(self, digits=2):
+        width = max([len(str(label)) for label in self.labels] + [5])
+        lines = [f"{'label':>{width}}  precision     recall         f1   accuracy    support"]
+        for label, p, r, f, a, s in zip(self.labels, self.precision(), self.recall(), self.f1(),
+                                        self.label_accuracy(), self.support()):
+            lines.append(f"{str(label):>{width}}  {p:9.{digits}f}  {r:9.{digits}f}  {f:9.{digits}f}  "
+                         f"{a:9.{digits}f}  {s:9d}")
+        lines.append(f"{'total':>{width}}  accuracy {self.accuracy():.{digits}f} on {self.total()} predictions")
+        return '\n'.join(lines)
+
+def _ratio(numerator, denominator):
+    # Element-wise division that gives 0 where the denominator is 0
+    numerator = np.asarray(numerator, dtype=float)
+    denominator = np.asarray(denominator, dtype=float)
+    return np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator > 0)
+
+def peak_memory_mb():
+    # Peak resident memory of this process and of its largest finished child process
+    if resource is None:
+        return None, None
+    scale = 1024 * 1024 if os.uname().sysname == 'Darwin' else 1024  # ru_maxrss is bytes on macOS, KB on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return own, children
+
+def current_memory_mb():
+    # Current resident memory of this process (Linux only, None elsewhere)
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except OSError:
+        return None
@@ -0,0 +1,180 @@
+#Content-addressed cache for the vectorization step of sklearn_randomforest.py.
+#CachedVectorizer wraps a vectorizer like TfidfVectorizer(stop_words='english') and can be used on its own or as a
+#Pipeline step. Fitting is keyed by a hash of the vectorizer parameters and of the input texts: if the same texts
+#were already fitted with the same parameters, the fitted vectorizer and the training matrix are loaded from disk
+#instead of being computed again. Larger transform() calls are cached the same way. Function parameters (tokenizer,
+#preprocessor, ...) are keyed by their module and name; a vectorizer with a lambda or another unnamed callable
+#is not cached.
+#
+#Every cache entry is a directory <cache_dir>/<key>/ with the CSR arrays as .npy files (data, indices, indptr),
+#loaded memory-mapped without a copy, meta.json with the matrix shape, and for fits the fitted vectorizer.
+#When the cache grows beyond max_bytes the least recently used entries are deleted.
+
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import tempfile
+
+import joblib
+import numpy as np
+from scipy import sparse
+from sklearn.base import BaseEstimator, TransformerMixin, clone
+from sklearn.utils.validation import check_is_fitted
+
+def content_key(prefix, texts):
+    # sha256 of a prefix and all texts; every text is preceded by its length so that no two
+    # different lists of texts produce the same byte stream
+    digest = hashlib.sha256(prefix.encode('utf-8'))
+    for text in texts:
+        data = str(text).encode('utf-8')
+        digest.update(len(data).to_bytes(8, 'little'))
+        digest.update(data)
+    return digest.hexdigest()
+
+def _param_key(value):
+    # repr of a function contains its memory address, so functions and classes are keyed by their import path.
+    # Callables without a stable name (lambdas, nested functions, partials, callable objects) give None.
+    # Nested estimators are keyed by their class, get_params(deep=True) lists their parameters separately
+    if isinstance(value, BaseEstimator):
+        return f'{type(value).__module__}.{type(value).__qualname__}'
+    if isinstance(value, (set, frozenset)):  # the order of a set of strings changes from run to run
+        keys = [_param_key(item) for item in value]
+        return None if None in keys else f"{type(value).__name__}({', '.join(sorted(keys))})"
+    if isinstance(value, (list, tuple, dict)):  # e.g. the steps of a Pipeline
+        items = list(value.items()) if isinstance(value, dict) else [(None, item) for item in value]
+        keys = [_param_key(item) for _, item in items]
+        if None in keys:
+            return None
+        parts = [key if name is None else f'{name!r}: {key}' for (name, _), key in zip(items, keys)]
+        return f"{type(value).__name__}({', '.join(parts)})"
+    if callable(value):
+        name = getattr(value, '__qualname__', None)
+        # methods of builtin types such as str.split have the module on their class
+        module = getattr(value, '__module__', None) or getattr(getattr(value, '__objclass__', None), '__module__', None)
+        if name is None or module is None or '<' in name or inspect.ismethod(value):
+            return None
+        return f'{module}.{name}'
+    return repr(value)
+
+def params_key(vectorizer):
+    # Key of the vectorizer class and its parameters, or None if a parameter cannot be keyed and the
+    # vectorizer is not cached
+    params = []
+    for name, value in sorted(vectorizer.get_params(deep=True).items()):
+        key = _param_key(value)
+        if key is None:
+            return None
+        params.append(f'{name}={key}')
+    return f"{type(vectorizer).__module__}.{type(vectorizer).__name__}({', '.join(params)})"
+
+class FeatureCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        # Return (matrix, fitted vectorizer or None) of a cached entry, or None. Another process can evict
+        # the entry while it is read; its files are then gone and that is a miss as well.
+        path = self._path(key)
+        if not os.path.isdir(path):
+            return None
+        try:
+            os.utime(path)  # mark as recently used
+            with open(os.path.join(path, 'meta.json'), 'r') as f:
+                meta = json.load(f)
+            data, indices, indptr = (np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+                                     for name in ('data', 'indices', 'indptr'))
+            # meta.json says whether the entry has a vectorizer, a missing file would look like an entry without one
+            vectorizer = joblib.load(os.path.join(path, 'vectorizer.joblib')) if meta['vectorizer'] else None
+        except FileNotFoundError:
+            return None
+        matrix = sparse.csr_matrix((data, indices, indptr), shape=tuple(meta['shape']), copy=False)
+        return matrix, vectorizer
+
+    def put(self, key, matrix, vectorizer=None):
+        # Write the entry into a temporary directory first so that readers never see half an entry
+        os.makedirs(self.directory, exist_ok=True)
+        matrix = sparse.csr_matrix(matrix)
+        tmp = tempfile.mkdtemp(dir=self.directory, prefix='.tmp-')
+        for name in ('data', 'indices', 'indptr'):
+            np.save(os.path.join(tmp, f'{name}.npy'), getattr(matrix, name))
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump({'shape': list(matrix.shape), 'vectorizer': vectorizer is not None}, f)
+        if vectorizer is not None:
+            joblib.dump(vectorizer, os.path.join(tmp, 'vectorizer.joblib'))
+        try:
+            os.rename(tmp, self._path(key))
+        except OSError:  # another process stored the same entry in the meantime
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        # Delete the least recently used entries until the cache fits into max_bytes
+        entries = []
+        for key in os.listdir(self.directory):
+            path = self._path(key)
+            if key.startswith('.') or not os.path.isdir(path):
+                continue
+            size = sum(entry.stat().st_size for entry in os.scandir(path))
+            entries.append((os.stat(path).st_mtime, size, key))
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key != keep:
+                shutil.rmtree(self._path(key), ignore_errors=True)
+                total -= size
+
+class CachedVectorizer(TransformerMixin, BaseEstimator):
+    #Vectorizer step that stores its fits and large transforms in a FeatureCache.
+    #transform() calls with fewer than min_rows texts (single sentences in the interactive loop) skip the cache.
+
+    def __init__(self, vectorizer, cache_dir='feature_cache', max_bytes=2 * 1024 ** 3, min_rows=100):
+        self.vectorizer = vectorizer
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.min_rows = min_rows
+
+    def fit(self, X, y=None):
+        self.fit_transform(X)
+        return self
+
+    def fit_transform(self, X, y=None):
+        texts = list(X)
+        params = params_key(self.vectorizer)
+        if params is None:  # a parameter without a stable key, such as a lambda tokenizer: no caching
+            self.fit_key_ = None
+            self.vectorizer_ = clone(self.vectorizer)
+            return self.vectorizer_.fit_transform(texts)
+        cache = FeatureCache(self.cache_dir, self.max_bytes)
+        self.fit_key_ = content_key(params, texts)
+        cached = cache.get(self.fit_key_)
+        if cached is not None:
+            matrix, self.vectorizer_ = cached
+            return matrix
+        self.vectorizer_ = clone(self.vectorizer)
+        matrix = self.vectorizer_.fit_transform(texts)
+        cache.put(self.fit_key_, matrix, self.vectorizer_)
+        return matrix
+
+    def transform(self, X):
+        check_is_fitted(self, 'vectorizer_')
+        texts = list(X)
+        if len(texts) < self.min_rows or self.fit_key_ is None:
+            return self.vectorizer_.transform(texts)
+        cache = FeatureCache(self.cache_dir, self.max_bytes)
+        key = content_key(self.fit_key_, texts)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached[0]
+        matrix = self.vectorizer_.transform(texts)
+        cache.put(key, matrix)
+        return matrix
+
+    def get_feature_names_out(self, input_features=None):
+        return self.vectorizer_.get_feature_names_out(input_features)
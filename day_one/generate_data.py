@@ -1,33 +1,142 @@
-# Program to generate data using NLTK to test the language identifier. The program generates 300 examples of (en,de,fr) and saves them in a txt file
-import nltk
-from random import shuffle
+# Program to generate labelled data to test the language identifier, in the format of sentences.txt: "sentence,lang".
+# Everything is generated offline from local text files: by default the training texts of lan_identifier.py
+# (english.txt, german.txt, french.txt), or a corpus directory with one <code>.txt file or <code>/ directory of
+# .txt files per language. Use a corpus that the profiles were not compiled from to measure accuracy; the
+# bundled texts are good for load tests only.
+#
+# Every output line is a window of --min-words to --max-words consecutive words of a random language's text.
+# The text is streamed word by word from a random byte offset and wraps around at its end, so any number of
+# lines can be generated from a small text and a large corpus is never loaded into memory.
+# The lines are written in shards of --shard-lines lines, one shard per task of a process pool. Each shard is
+# mixed with a shuffle buffer of --shuffle-window lines, so memory stays bounded however many lines are generated.
+# The random generator of every shard is seeded with --seed and the shard number, so the output does not depend
+# on the number of processes.
 
-# Download the necessary corpora
-nltk.download('reuters')
-nltk.download('europarl_raw')
+import argparse
+import os
+import random
+import time
+from itertools import islice
+from multiprocessing import Pool
 
-from nltk.corpus import reuters, europarl_raw
+from lan_identifier import LANGUAGES
 
+def text_files(directory):
+    # All .txt files below a directory, in a fixed order
+    files = []
+    for root, dirs, names in os.walk(directory):
+        dirs.sort()
+        files.extend(os.path.join(root, name) for name in sorted(names) if name.endswith('.txt'))
+    return files
 
-#print(reuters.categories())
+def corpus_sources(directory):
+    # {lang: [files]} of a corpus directory with <code>.txt files and/or <code>/ directories
+    sources = {}
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isdir(path):
+            sources.setdefault(name, []).extend(text_files(path))
+        elif name.endswith('.txt'):
+            sources.setdefault(name[:-len('.txt')], []).append(path)
+    return sources
 
-# Extract sentences (using 'acq' as an example category from reuters)
-english_sentences = reuters.sents(categories='acq')[:100]
-german_sentences = europarl_raw.german.sents()[:100]
-french_sentences = europarl_raw.french.sents()[:100]
+def stream_words(paths, rng, encoding='utf-8'):
+    # Words of the files in paths, endlessly, starting after the line break that follows a random byte
+    sizes = [os.path.getsize(path) for path in paths]
+    position = rng.randrange(sum(sizes))
+    i = 0
+    while position >= sizes[i]:
+        position -= sizes[i]
+        i += 1
+    empty_files = 0
+    while True:
+        found = False
+        with open(paths[i], 'rb') as f:
+            if position:
+                f.seek(position - 1)
+                f.readline()  # skip to the start of the next line
+                position = 0
+            for line in f:
+                words = line.decode(encoding, errors='replace').split()
+                if words:
+                    found = True
+                    yield from words
+        empty_files = 0 if found else empty_files + 1
+        if empty_files > len(paths):  # a whole round without a word
+            raise ValueError(f'no words in {paths}')
+        i = (i + 1) % len(paths)
 
-# Convert sentences to desired format
-formatted_english = [" ".join(sent) + ",en" for sent in english_sentences]
-formatted_german = [" ".join(sent) + ",de" for sent in german_sentences]
-formatted_french = [" ".join(sent) + ",fr" for sent in french_sentences]
+def shuffle_window(items, window, rng):
+    # Shuffle an iterable with a buffer of window items: every new item replaces a random buffered item,
+    # which is yielded. window=1 keeps the order.
+    buffer = []
+    for item in items:
+        if len(buffer) < window:
+            buffer.append(item)
+            continue
+        j = rng.randrange(window)
+        yield buffer[j]
+        buffer[j] = item
+    rng.shuffle(buffer)
+    yield from buffer
 
-# Combine all sentences
-all_sentences = formatted_english + formatted_german + formatted_french
+def write_shard(job):
+    index, path, lines, sources, args = job
+    rng = random.Random(f'{args.seed}-{index}')
+    languages = list(sources)
+    streams = {lang: stream_words(paths, rng, args.encoding) for lang, paths in sources.items()}
 
-# Shuffle the sentences to mix them up
-shuffle(all_sentences)
+    def labelled_lines():
+        for _ in range(lines):
+            lang = rng.choice(languages)
+            words = islice(streams[lang], rng.randint(args.min_words, args.max_words))
+            yield f"{' '.join(words)},{lang}\n"
 
-# Write the sentences to a file
-with open('sentences.txt', 'w') as f:
-    for sentence in all_sentences:
-        f.write(sentence + '\n')
+    # Written under a temporary name, so that a shard file is either complete or missing
+    with open(path + '.tmp', 'w', encoding='utf-8') as out:
+        out.writelines(shuffle_window(labelled_lines(), args.shuffle_window, rng))
+    os.replace(path + '.tmp', path)
+    return path, lines
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate labelled sentences for the language identifier offline.')
+    parser.add_argument('--source', nargs=2, action='append', default=[], metavar=('CODE', 'PATH'),
+                        help='text file or directory of .txt files of a language (can be repeated)')
+    parser.add_argument('--corpus-dir', help='directory with a <code>.txt file or <code>/ directory per language')
+    parser.add_argument('--encoding', default='utf-8', help='encoding of the source texts')
+    parser.add_argument('--lines', type=int, default=1000000)
+    parser.add_argument('--shard-lines', type=int, default=100000, help='lines per output file')
+    parser.add_argument('--out-dir', default='generated')
+    parser.add_argument('--prefix', default='sentences')
+    parser.add_argument('--min-words', type=int, default=5)
+    parser.add_argument('--max-words', type=int, default=25)
+    parser.add_argument('--shuffle-window', type=int, default=10000, help='lines held in the shuffle buffer')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--jobs', type=int, default=None, help='number of processes')
+    args = parser.parse_args()
+
+    sources = corpus_sources(args.corpus_dir) if args.corpus_dir else {}
+    for lang, path in args.source:
+        sources.setdefault(lang, []).extend(text_files(path) if os.path.isdir(path) else [path])
+    if not sources:
+        sources = {lang: [filename] for lang, filename in LANGUAGES.items()}
+    for lang, paths in sources.items():
+        if not any(os.path.getsize(path) for path in paths):
+            parser.error(f'no text for language {lang}')
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    jobs = []
+    for index, start in enumerate(range(0, args.lines, args.shard_lines)):
+        path = os.path.join(args.out_dir, f'{args.prefix}-{index:05d}.txt')
+        jobs.append((index, path, min(args.shard_lines, args.lines - start), sources, args))
+
+    start = time.perf_counter()
+    with Pool(args.jobs) as pool:
+        for path, lines in pool.imap_unordered(write_shard, jobs):
+            print(f'{path}: {lines} lines')
+    elapsed = time.perf_counter() - start
+    print(f"{args.lines} lines of {', '.join(sources)} in {len(jobs)} shards, "
+          f"{args.lines / elapsed:,.0f} lines/sec")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+# Compact array format for the HMM POS tagger trained in hmm_nltk.py.
+# Instead of pickling the NLTK object graph with dill, the model is written as a directory of
+# plain NumPy arrays (log2 probabilities, like NLTK uses internally) plus the tag and word lists:
+#
+#   priors.npy       (tags,)            log P(tag[0] = i)
+#   transitions.npy  (tags, tags)       log P(tag[t] = j | tag[t-1] = i)
+#   emissions.npy    (words + 1, tags)  log P(word | tag), one row per word, the last row is used
+#                                       for words that were not seen in training
+#   tags.json, words.json               the tag and word of every index
+#
+# The .npy files are memory-mapped when loaded, so several tagger processes share one copy.
+# tag_sents decodes padded batches of sentences at once with a vectorized Viterbi.
+# Run this file to export hmm_tagger.pkl and compare loading and tagging speed with the dill path.
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+UNKNOWN_WORD = '\0<unknown>\0'  # never a real token, used to ask NLTK for the unseen word probability
+
+def hmm_to_arrays(tagger):
+    # Read the probabilities of a trained nltk HiddenMarkovModelTagger into
+    # (tags, words, priors, transitions, emissions)
+    tags = list(tagger._states)
+    words = [word for word in tagger._symbols if word != UNKNOWN_WORD]
+    priors = np.array([tagger._priors.logprob(tag) for tag in tags], dtype=np.float32)
+    transitions = np.array([[tagger._transitions[prev].logprob(tag) for tag in tags] for prev in tags],
+                           dtype=np.float32)
+    emissions = np.empty((len(words) + 1, len(tags)), dtype=np.float32)
+    for j, tag in enumerate(tags):
+        outputs = tagger._outputs[tag]
+        emissions[:-1, j] = [outputs.logprob(word) for word in words]
+        emissions[-1, j] = outputs.logprob(UNKNOWN_WORD)
+    return tags, words, priors, transitions, emissions
+
+def export_hmm(tagger, directory):
+    # Write a trained nltk HiddenMarkovModelTagger as arrays
+    save_arrays(directory, *hmm_to_arrays(tagger))
+
+def save_arrays(directory, tags, words, priors, transitions, emissions):
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, 'priors.npy'), priors)
+    np.save(os.path.join(directory, 'transitions.npy'), transitions)
+    np.save(os.path.join(directory, 'emissions.npy'), emissions)
+    with open(os.path.join(directory, 'tags.json'), 'w', encoding='utf-8') as f:
+        json.dump(tags, f, ensure_ascii=False)
+    with open(os.path.join(directory, 'words.json'), 'w', encoding='utf-8') as f:
+        json.dump(words, f, ensure_ascii=False)
+
+class ArrayHMMTagger:
+    # Viterbi tagger over the exported arrays. It follows the arithmetic of NLTK's
+    # HiddenMarkovModelTagger._best_path (float32, first best on ties), so it returns the same tags.
+
+    def __init__(self, tags, words, priors, transitions, emissions):
+        self.tags = tags
+        self.word_index = {word: i for i, word in enumerate(words)}
+        self.unknown = len(words)
+        self.priors = priors
+        self.transitions = transitions
+        self.emissions = emissions
+
+    def word_ids(self, tokens):
+        return [self.word_index.get(token, self.unknown) for token in tokens]
+
+    def best_path(self, tokens):
+        if not tokens:
+            return []
+        observed = self.emissions[self.word_ids(tokens)]   # (T, tags)
+        backpointers = np.zeros((len(tokens), len(self.tags)), dtype=np.int64)
+        scores = self.priors + observed[0]
+        for t in range(1, len(tokens)):
+            candidates = scores[:, None] + self.transitions  # previous tag x next tag
+            backpointers[t] = candidates.argmax(axis=0)
+            scores = candidates[backpointers[t], np.arange(len(self.tags))] + observed[t]
+        best = [int(scores.argmax())]
+        for t in range(len(tokens) - 1, 0, -1):
+            best.append(int(backpointers[t, best[-1]]))
+        return [self.tags[i] for i in reversed(best)]
+
+    def tag(self, tokens):
+        return list(zip(tokens, self.best_path(tokens)))
+
+    def best_paths(self, batch):
+        # Viterbi over a batch of sentences padded to the longest one. Every step works on a
+        # (sentences, previous tag, next tag) array; sentences that already ended keep their scores.
+        lengths = np.array([len(tokens) for tokens in batch])
+        n_tags = len(self.tags)
+        ids = np.full((len(batch), lengths.max()), self.unknown)
+        for b, tokens in enumerate(batch):
+            ids[b, :len(tokens)] = self.word_ids(tokens)
+        backpointers = np.zeros((len(batch), ids.shape[1], n_tags), dtype=np.int32)
+        scores = self.priors + self.emissions[ids[:, 0]]
+        for t in range(1, ids.shape[1]):
+            candidates = scores[:, :, None] + self.transitions
+            best = candidates.argmax(axis=1)
+            backpointers[:, t] = best
+            stepped = np.take_along_axis(candidates, best[:, None, :], axis=1)[:, 0] + self.emissions[ids[:, t]]
+            scores = np.where((t < lengths)[:, None], stepped, scores)
+
+        rows = np.arange(len(batch))
+        paths = np.zeros(ids.shape, dtype=np.int64)
+        paths[rows, lengths - 1] = scores.argmax(axis=1)
+        for t in range(ids.shape[1] - 1, 0, -1):
+            inside = t < lengths
+            previous = backpointers[rows, t, paths[:, t]]
+            paths[inside, t - 1] = previous[inside]
+        return [[self.tags[i] for i in path[:length]] for path, length in zip(paths, lengths)]
+
+    def tag_sents(self, sentences, batch_size=256):
+        # Sentences are decoded in batches of similar length to keep the padding small
+        order = sorted((i for i, tokens in enumerate(sentences) if tokens), key=lambda i: len(sentences[i]))
+        paths = [[] for _ in sentences]
+        for start in range(0, len(order), batch_size):
+            indices = order[start:start + batch_size]
+            for i, path in zip(indices, self.best_paths([sentences[i] for i in indices])):
+                paths[i] = path
+        return [list(zip(tokens, path)) for tokens, path in zip(sentences, paths)]
+
+def load_hmm(directory, mmap=True):
+    # Load an exported model; with mmap the arrays are paged in from the files on demand
+    mmap_mode = 'r' if mmap else None
+    arrays = [np.load(os.path.join(directory, name), mmap_mode=mmap_mode)
+              for name in ('priors.npy', 'transitions.npy', 'emissions.npy')]
+    with open(os.path.join(directory, 'tags.json'), 'r', encoding='utf-8') as f:
+        tags = json.load(f)
+    with open(os.path.join(directory, 'words.json'), 'r', encoding='utf-8') as f:
+        words = json.load(f)
+    return ArrayHMMTagger(tags, words, *arrays)
+
+def main():
+    import dill
+    from nltk.corpus import treebank
+
+    parser = argparse.ArgumentParser(description='Export the dill HMM tagger to arrays and compare both.')
+    parser.add_argument('--pickle', default='hmm_tagger.pkl', help='tagger saved by hmm_nltk.py')
+    parser.add_argument('--out', default='hmm_tagger_arrays', help='directory for the array model')
+    args = parser.parse_args()
+
+    with open(args.pickle, 'rb') as f:
+        tagger = dill.load(f)
+    export_hmm(tagger, args.out)
+
+    # NLTK fills its log probability tables on the first tag() call, so the time until the first
+    # sentence is tagged is measured as well
+    sentences = [[word for word, _ in sent] for sent in treebank.tagged_sents()[-500:]]
+
+    start = time.perf_counter()
+    with open(args.pickle, 'rb') as f:
+        tagger = dill.load(f)
+    dill_time = time.perf_counter() - start
+    tagger.tag(sentences[0])
+    dill_ready = time.perf_counter() - start
+
+    start = time.perf_counter()
+    array_tagger = load_hmm(args.out)
+    array_time = time.perf_counter() - start
+    array_tagger.tag(sentences[0])
+    array_ready = time.perf_counter() - start
+
+    tokens = sum(len(sentence) for sentence in sentences)
+    start = time.perf_counter()
+    nltk_tagged = tagger.tag_sents(sentences)
+    nltk_time = time.perf_counter() - start
+    start = time.perf_counter()
+    array_tagged = array_tagger.tag_sents(sentences)
+    array_tag_time = time.perf_counter() - start
+    same = sum(a == b for a, b in zip(nltk_tagged, array_tagged))
+
+    size = os.path.getsize(args.pickle) / 1e6
+    print(f"dill:   load {dill_time * 1000:8.1f} ms, first tag after {dill_ready * 1000:8.1f} ms  ({size:.1f} MB)")
+    size = sum(os.path.getsize(os.path.join(args.out, name)) for name in os.listdir(args.out)) / 1e6
+    print(f"arrays: load {array_time * 1000:8.1f} ms, first tag after {array_ready * 1000:8.1f} ms  ({size:.1f} MB)")
+    print(f"NLTK tag_sents:    {tokens / nltk_time:12,.0f} tokens/sec")
+    print(f"Batched Viterbi:   {tokens / array_tag_time:12,.0f} tokens/sec")
+    print(f"Identical tags on {same} of {len(sentences)} test sentences")
+
+if __name__ == "__main__":
+    main()
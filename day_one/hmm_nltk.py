@@ -8,6 +8,8 @@ from nltk import HiddenMarkovModelTagger as hmm # do not use nltk.tag.hmm
 from nltk.corpus import treebank
 import warnings
 import dill
+from hmm_arrays import ArrayHMMTagger, export_hmm, hmm_to_arrays, load_hmm
+from evaluation import ConfusionMatrix
 
 
 warnings.filterwarnings('ignore')
@@ -45,33 +47,36 @@ print(f"Accuracy: {accuracy:.2f}")
 #Generate true tags list and model prediction to get more detailed stats on where the model performed better and where it didn't perform so well
 
 
-# Generate Predictions
+# Generate Predictions. ArrayHMMTagger uses the same probabilities as the NLTK tagger and gives the same tags,
+# but decodes whole batches of sentences with NumPy instead of one sentence at a time
+array_tagger = ArrayHMMTagger(*hmm_to_arrays(tagger))
 true_tags = [tag for sent in test_data for _, tag in sent]
-predicted_tags = [tag for sent in tagger.tag_sents([[word for word, _ in sent] for sent in test_data]) for _, tag in sent]
+predicted_tags = [tag for sent in array_tagger.tag_sents([[word for word, _ in sent] for sent in test_data]) for _, tag in sent]
 
 
-# Compute accuracy for each label
-labels = list(set(true_tags))
-for label in labels:
-    correct_predictions = sum(1 for t, p in zip(true_tags, predicted_tags) if t == label and p == label)
-    total_predictions = sum(1 for t in true_tags if t == label)
+# Compute accuracy for each label. The confusion matrix is counted in one pass over the predictions
+evaluation = ConfusionMatrix().update_labels(true_tags, predicted_tags)
+for label, correct_predictions, total_predictions, precision, label_accuracy in zip(
+        evaluation.labels, evaluation.correct(), evaluation.support(), evaluation.precision(), evaluation.recall()):
     wrong_predictions = total_predictions - correct_predictions
-    label_accuracy = correct_predictions / total_predictions if total_predictions > 0 else 0
 
     print(f"Label: {label}")
     print(f"Correct Predictions: {correct_predictions}")
     print(f"Wrong Predictions: {wrong_predictions}")
+    print(f"Precision: {precision:.2f}")
     print(f"Accuracy: {label_accuracy:.2f}\n")
 
 
-# Save the trained model to a file
+# Save the trained model to a file. The dill pickle is only kept to compare it with the array format (run hmm_arrays.py)
 with open('hmm_tagger.pkl', 'wb') as f:
     dill.dump(tagger, f)
 
+# Save the model as plain NumPy arrays, which load without rebuilding NLTK's probability tables
+export_hmm(tagger, 'hmm_tagger_arrays')
 
-# Load the trained model from the file
-with open('hmm_tagger.pkl', 'rb') as f:
-    loaded_tagger = dill.load(f)
+
+# Load the trained model from the arrays. They are memory-mapped, so many processes can share them
+loaded_tagger = load_hmm('hmm_tagger_arrays')
 
 
 sentence = 'I took the train from Zurich to Italy last night'
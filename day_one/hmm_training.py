@@ -0,0 +1,196 @@
+# Sharded and incremental training for the HMM POS tagger of hmm_nltk.py.
+# hmm.train counts starting tags, tag transitions and word emissions over the whole corpus and
+# smooths them straight away. Here the raw counts are kept instead: shards of the corpus are
+# counted in a process pool, the count tables are merged and saved, and new tagged sentences can
+# be added to saved counts later without recounting the old corpus. Smoothing (Lidstone with
+# gamma 0.1, like hmm.train) is only applied when the counts are turned into a tagger.
+
+import argparse
+import json
+import math
+import os
+import time
+from collections import Counter
+from itertools import islice
+from multiprocessing import Pool
+
+import numpy as np
+from nltk import ConditionalFreqDist, ConditionalProbDist, FreqDist, LidstoneProbDist
+from nltk import HiddenMarkovModelTagger as hmm
+
+from hmm_arrays import ArrayHMMTagger, save_arrays
+
+GAMMA = 0.1
+
+class HMMCounts:
+    # Count tables of a tagged corpus. Tags and words are kept in order of first appearance,
+    # which is the order hmm.train uses, so ties are broken the same way after merging.
+
+    def __init__(self):
+        self.tags = []
+        self.words = []
+        self.starting = Counter()       # tag -> sentences starting with it
+        self.transitions = Counter()    # (previous tag, tag) -> count
+        self.outputs = Counter()        # (tag, word) -> count
+        self._known_tags = set()
+        self._known_words = set()
+
+    def _add_tag(self, tag):
+        if tag not in self._known_tags:
+            self._known_tags.add(tag)
+            self.tags.append(tag)
+
+    def _add_word(self, word):
+        if word not in self._known_words:
+            self._known_words.add(word)
+            self.words.append(word)
+
+    def add(self, tagged_sents):
+        for sent in tagged_sents:
+            previous = None
+            for word, tag in sent:
+                self._add_word(word)
+                self._add_tag(tag)
+                if previous is None:
+                    self.starting[tag] += 1
+                else:
+                    self.transitions[previous, tag] += 1
+                self.outputs[tag, word] += 1
+                previous = tag
+        return self
+
+    def merge(self, other):
+        # Add the counts of a later shard
+        for word in other.words:
+            self._add_word(word)
+        for tag in other.tags:
+            self._add_tag(tag)
+        self.starting.update(other.starting)
+        self.transitions.update(other.transitions)
+        self.outputs.update(other.outputs)
+        return self
+
+    def save(self, filename):
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump({
+                'tags': self.tags,
+                'words': self.words,
+                'starting': list(self.starting.items()),
+                'transitions': [[previous, tag, count] for (previous, tag), count in self.transitions.items()],
+                'outputs': [[tag, word, count] for (tag, word), count in self.outputs.items()],
+            }, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        counts = cls()
+        for word in data['words']:
+            counts._add_word(word)
+        for tag in data['tags']:
+            counts._add_tag(tag)
+        counts.starting.update(dict(data['starting']))
+        counts.transitions.update({(previous, tag): count for previous, tag, count in data['transitions']})
+        counts.outputs.update({(tag, word): count for tag, word, count in data['outputs']})
+        return counts
+
+    def to_tagger(self, estimator=None):
+        # Smooth the counts into the same nltk HiddenMarkovModelTagger that hmm.train would build
+        if estimator is None:
+            def estimator(fd, bins):
+                return LidstoneProbDist(fd, GAMMA, bins)
+        starting = FreqDist(self.starting)
+        transitions = ConditionalFreqDist()
+        for (previous, tag), count in self.transitions.items():
+            transitions[previous][tag] = count
+        outputs = ConditionalFreqDist()
+        for (tag, word), count in self.outputs.items():
+            outputs[tag][word] = count
+        n_tags = len(self.tags)
+        return hmm(list(self.words), list(self.tags),
+                   ConditionalProbDist(transitions, estimator, n_tags),
+                   ConditionalProbDist(outputs, estimator, len(self.words)),
+                   estimator(starting, n_tags))
+
+    def to_arrays(self, gamma=GAMMA):
+        # Smooth the counts directly into the arrays of hmm_arrays, without building the NLTK
+        # probability objects: (tags, words, priors, transitions, emissions)
+        tag_index = {tag: i for i, tag in enumerate(self.tags)}
+        word_index = {word: k for k, word in enumerate(self.words)}
+        starting = np.zeros(len(self.tags))
+        for tag, count in self.starting.items():
+            starting[tag_index[tag]] = count
+        transitions = np.zeros((len(self.tags), len(self.tags)))
+        for (previous, tag), count in self.transitions.items():
+            transitions[tag_index[previous], tag_index[tag]] = count
+        emissions = np.zeros((len(self.words) + 1, len(self.tags)))  # last row: unseen words
+        for (tag, word), count in self.outputs.items():
+            emissions[word_index[word], tag_index[tag]] = count
+
+        n_tags, n_words = len(self.tags), len(self.words)
+        return (list(self.tags), list(self.words),
+                lidstone_log2(starting, starting.sum(), n_tags, gamma),
+                lidstone_log2(transitions, transitions.sum(axis=1, keepdims=True), n_tags, gamma),
+                lidstone_log2(emissions, emissions.sum(axis=0, keepdims=True), n_words, gamma))
+
+    def to_array_tagger(self, gamma=GAMMA):
+        return ArrayHMMTagger(*self.to_arrays(gamma))
+
+def lidstone_log2(counts, totals, bins, gamma=GAMMA):
+    # log2((count + gamma) / (total + bins * gamma)) computed like LidstoneProbDist.logprob.
+    # math.log is applied to the few distinct probabilities only, so the values match NLTK exactly.
+    probabilities = (counts + gamma) / (totals + bins * gamma)
+    distinct, inverse = np.unique(probabilities, return_inverse=True)
+    logs = np.array([math.log(p, 2) if p != 0 else -math.inf for p in distinct])
+    return logs[inverse].reshape(probabilities.shape).astype(np.float32)
+
+def count_shard(tagged_sents):
+    return HMMCounts().add(tagged_sents)
+
+def shards_of(tagged_sents, shard_size):
+    sents = iter(tagged_sents)
+    while True:
+        shard = [list(sent) for sent in islice(sents, shard_size)]
+        if not shard:
+            return
+        yield shard
+
+def count_parallel(tagged_sents, jobs=None, shard_size=500):
+    # Count shards of the corpus in a process pool and merge them in corpus order
+    total = HMMCounts()
+    with Pool(jobs) as pool:
+        for counts in pool.imap(count_shard, shards_of(tagged_sents, shard_size)):
+            total.merge(counts)
+    return total
+
+def main():
+    from nltk.corpus import treebank
+
+    parser = argparse.ArgumentParser(description='Count a slice of the treebank in parallel and add it to saved counts.')
+    parser.add_argument('--counts', default='hmm_counts.json', help='saved counts, created or updated')
+    parser.add_argument('--start', type=int, default=0, help='first treebank sentence to add')
+    parser.add_argument('--stop', type=int, default=2000, help='treebank sentence to stop before')
+    parser.add_argument('--jobs', type=int, default=None)
+    parser.add_argument('--shard-size', type=int, default=500)
+    parser.add_argument('--out', default='hmm_tagger_arrays', help='directory for the finalized array model')
+    args = parser.parse_args()
+
+    counts = HMMCounts.load(args.counts) if os.path.exists(args.counts) else HMMCounts()
+
+    start = time.perf_counter()
+    new_counts = count_parallel(treebank.tagged_sents()[args.start:args.stop], args.jobs, args.shard_size)
+    counting_time = time.perf_counter() - start
+    counts.merge(new_counts)
+    counts.save(args.counts)
+
+    start = time.perf_counter()
+    save_arrays(args.out, *counts.to_arrays())
+    finalize_time = time.perf_counter() - start
+
+    sentences = sum(counts.starting.values())
+    print(f"Counted {sum(new_counts.starting.values())} new sentences in {counting_time:.2f}s, "
+          f"{sentences} sentences in total")
+    print(f"{len(counts.tags)} tags, {len(counts.words)} words, finalized in {finalize_time:.2f}s to {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -1,75 +1,249 @@
-from collections import Counter
+from collections import Counter, deque
+from itertools import islice
+from multiprocessing import Pool
+import argparse
+import hashlib
+import json
+import os
 import re
+import time
+import unicodedata
+
+from evaluation import ConfusionMatrix, peak_memory_mb
+
+# Default training text for every language and the n-gram sizes used in its profile.
+# More languages can be added to the profiles directory with --add CODE TEXT_FILE.
+LANGUAGES = {'en': 'english.txt', 'de': 'german.txt', 'fr': 'french.txt'}
+LANGUAGE_NAMES = {'en': 'English', 'de': 'German', 'fr': 'French'}
+NGRAM_SIZES = (2, 3)
+PROFILES_DIR = 'profiles'
+
+NON_LETTERS = re.compile(r'[\W\d_]+')
+
+def normalize(text):
+    # Compose accents (e + combining acute -> é) and keep only letters, in any script
+    text = unicodedata.normalize('NFC', text).lower()
+    return NON_LETTERS.sub('', text)  # remove non-alphabetic characters
 
 def extract_ngrams(text, n):
     return [text[i:i+n] for i in range(len(text)-n+1)]
 
 def get_top_ngrams(filename, n, top=100):
     with open(filename, 'r', encoding='utf-8') as f:
-        text = f.read().lower()
-        text = re.sub(r'[^a-z]', '', text)  # remove non-alphabetic characters
+        text = normalize(f.read())
         ngrams = extract_ngrams(text, n)
         return [item[0] for item in Counter(ngrams).most_common(top)]
 
+def file_hash(filename):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def source_stat(filename):
+    stat = os.stat(filename)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def write_profile(lang, profile, directory=PROFILES_DIR):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, f'{lang}.json'), 'w', encoding='utf-8') as f:
+        json.dump(profile, f, ensure_ascii=False, separators=(',', ':'))
+
+def compile_profile(lang, filename, directory=PROFILES_DIR, sizes=NGRAM_SIZES, top=100):
+    # Store the top n-grams of one language as <directory>/<lang>.json, with the training text it was compiled
+    # from, its size, modification time and hash:
+    # {"source": ..., "size": ..., "mtime_ns": ..., "sha256": ..., "top": 100, "ngrams": {"2": [...], ...}}
+    profile = {'source': filename, **source_stat(filename), 'sha256': file_hash(filename), 'top': top,
+               'ngrams': {str(n): get_top_ngrams(filename, n, top) for n in sizes}}
+    write_profile(lang, profile, directory)
+    return profile
+
+def compile_profiles(directory=PROFILES_DIR, languages=LANGUAGES, sizes=NGRAM_SIZES, top=100):
+    for lang, filename in languages.items():
+        compile_profile(lang, filename, directory, sizes, top)
+
+def refresh_profile(lang, profile, directory=PROFILES_DIR):
+    # Compile the profile again if its training text changed since it was compiled. Only a stat of the text
+    # is needed while its size and modification time are the same; otherwise the text is hashed, so a
+    # touched but unchanged text is not compiled again. A profile whose text is not found (e.g. run from
+    # another directory) is used as it is.
+    source = profile['source']
+    try:
+        stat = source_stat(source)
+    except FileNotFoundError:
+        return profile
+    if stat == {'size': profile['size'], 'mtime_ns': profile['mtime_ns']}:
+        return profile
+    if file_hash(source) == profile['sha256']:
+        profile.update(stat)  # remember the new modification time, the next load only needs the stat again
+        write_profile(lang, profile, directory)
+        return profile
+    print(f"Training text {source} changed, compiling the '{lang}' profile again")
+    sizes = [int(n) for n in profile['ngrams']]
+    return compile_profile(lang, source, directory, sizes, profile['top'])
+
+def profile_order(lang):
+    # The default languages come first, in the order of LANGUAGES, then the added ones by code.
+    # Scores that tie go to the first language, so a tie is detected as English as it always was.
+    defaults = list(LANGUAGES)
+    return (defaults.index(lang), '') if lang in defaults else (len(defaults), lang)
+
+def load_profiles(directory=PROFILES_DIR):
+    # Load every <lang>.json of the directory as {lang: {n: set of n-grams}}, in profile_order. The
+    # default profiles are compiled first if the directory has none yet, and profiles whose training
+    # text changed are compiled again.
+    if not os.path.isdir(directory) or not any(name.endswith('.json') for name in os.listdir(directory)):
+        compile_profiles(directory)
+    langs = sorted((name[:-len('.json')] for name in os.listdir(directory) if name.endswith('.json')),
+                   key=profile_order)
+    profiles = {}
+    for lang in langs:
+        with open(os.path.join(directory, f'{lang}.json'), 'r', encoding='utf-8') as f:
+            profile = refresh_profile(lang, json.load(f), directory)
+        profiles[lang] = {int(n): frozenset(ngrams) for n, ngrams in profile['ngrams'].items()}
+    return profiles
+
 def calculate_score(sentence, ngrams_list, n):
     sentence_ngrams = extract_ngrams(sentence, n)
     return sum([1 for ng in sentence_ngrams if ng in ngrams_list])
 
-def test_accuracy(filename):
-    en_bigram = get_top_ngrams('english.txt', 2)
-    en_trigram = get_top_ngrams('english.txt', 3)
-    de_bigram = get_top_ngrams('german.txt', 2)
-    de_trigram = get_top_ngrams('german.txt', 3)
-    fr_bigram = get_top_ngrams('french.txt', 2)
-    fr_trigram = get_top_ngrams('french.txt', 3)
-
-    correct_predictions = 0
-    total_sentences = 0
-
-    with open(filename, 'r') as f:
+class NgramIndex:
+    # Inverted index from an n-gram to the (language, weight) pairs of the profiles that contain it.
+    # A sentence is scored by extracting its n-grams once and looking each one up a single time,
+    # so the cost per sentence does not grow with the number of languages.
+
+    def __init__(self, profiles):
+        self.languages = list(profiles)
+        self.sizes = sorted({n for profile in profiles.values() for n in profile})
+        postings = {}
+        for i, profile in enumerate(profiles.values()):
+            for ngrams in profile.values():
+                for ngram in ngrams:
+                    postings.setdefault(ngram, []).append((i, 1))
+        self.postings = {ngram: tuple(entries) for ngram, entries in postings.items()}
+
+    def score(self, sentence):
+        scores = [0] * len(self.languages)
+        for n in self.sizes:
+            for i in range(len(sentence)-n+1):
+                for lang, weight in self.postings.get(sentence[i:i+n], ()):
+                    scores[lang] += weight
+        return dict(zip(self.languages, scores))
+
+def detect_language(sentence, index):
+    # Score a normalized sentence against every language and return the best one with all scores.
+    # max keeps the first of tied languages, which is English before German and French (see profile_order)
+    scores = index.score(sentence)
+    return max(scores, key=scores.get), scores
+
+def test_accuracy(filename, index=None, encoding='latin-1'):
+    # sentences.txt is stored in latin-1, not utf-8
+    if index is None:
+        index = NgramIndex(load_profiles())
+
+    actual_languages = []
+    detected_languages = []
+
+    with open(filename, 'r', encoding=encoding) as f:
         for line in f:
             sentence, actual_language = line.strip().rsplit(',', 1)
-            sentence = sentence.lower()
-            sentence = re.sub(r'[^a-z]', '', sentence)  # remove non-alphabetic characters
-
-            en_score = calculate_score(sentence, en_bigram, 2) + calculate_score(sentence, en_trigram, 3)
-            de_score = calculate_score(sentence, de_bigram, 2) + calculate_score(sentence, de_trigram, 3)
-            fr_score = calculate_score(sentence, fr_bigram, 2) + calculate_score(sentence, fr_trigram, 3)
+            detected_language, _ = detect_language(normalize(sentence), index)
 
-            scores = {'en': en_score, 'de': de_score, 'fr': fr_score}
-            detected_language = max(scores, key=scores.get)
+            actual_languages.append(actual_language)
+            detected_languages.append(detected_language)
 
-            if detected_language == actual_language:
-                correct_predictions += 1
-            total_sentences += 1
+    accuracy = ConfusionMatrix(index.languages).update_labels(actual_languages, detected_languages).accuracy()
+    print(f"Accuracy: {accuracy:.2f}")
+    return accuracy
+
+# Parallel evaluation: the labelled file is read in chunks of lines, every worker process loads
+# the profiles once and returns the confusion matrix of each chunk it scores.
+_worker_index = None
+
+def _init_worker(profiles_dir):
+    global _worker_index
+    _worker_index = NgramIndex(load_profiles(profiles_dir))
+
+def _evaluate_chunk(lines):
+    actual_languages = []
+    detected_languages = []
+    for line in lines:
+        sentence, actual_language = line.strip().rsplit(',', 1)
+        detected_language, _ = detect_language(normalize(sentence), _worker_index)
+        actual_languages.append(actual_language)
+        detected_languages.append(detected_language)
+    return ConfusionMatrix(_worker_index.languages).update_labels(actual_languages, detected_languages)
+
+def evaluate_parallel(filename, profiles_dir=PROFILES_DIR, jobs=None, chunk_size=10000, encoding='latin-1'):
+    # Same predictions as test_accuracy, spread over a process pool. At most two chunks per
+    # process are in flight, so memory stays bounded however large the file is.
+    languages = list(load_profiles(profiles_dir))  # also compiles missing profiles before the workers start
+    confusion = ConfusionMatrix(languages)
+    start = time.perf_counter()
+    with Pool(jobs, initializer=_init_worker, initargs=(profiles_dir,)) as pool, \
+            open(filename, 'r', encoding=encoding) as f:
+        pending = deque()
+        max_pending = 2 * (jobs or os.cpu_count() or 1)
+        while True:
+            lines = list(islice(f, chunk_size))
+            if lines:
+                pending.append(pool.apply_async(_evaluate_chunk, (lines,)))
+            if pending and (len(pending) >= max_pending or not lines):
+                confusion.merge(pending.popleft().get())
+            elif not lines:
+                break
+    elapsed = time.perf_counter() - start
+
+    total_sentences = confusion.total()
+    accuracy = confusion.accuracy()
 
-    accuracy = correct_predictions / total_sentences
     print(f"Accuracy: {accuracy:.2f}")
+    print("Confusion matrix (rows: actual, columns: detected):")
+    print(' ' * 8 + ''.join(f'{label:>8}' for label in confusion.labels))
+    for actual, row in zip(confusion.labels, confusion.matrix):
+        print(f'{actual:>8}' + ''.join(f'{count:>8}' for count in row))
+    print(confusion.report())
+    print(f"Sentences/sec: {total_sentences / elapsed:,.0f} ({total_sentences} sentences in {elapsed:.2f}s)")
+    own, children = peak_memory_mb()
+    if own is not None:
+        print(f"Peak memory: {own:.1f} MB main process, {children:.1f} MB largest worker")
+    return accuracy, confusion
 
 def main():
-    test_accuracy('sentences.txt')
-    en_bigram = get_top_ngrams('english.txt', 2)
-    en_trigram = get_top_ngrams('english.txt', 3)
-    de_bigram = get_top_ngrams('german.txt', 2)
-    de_trigram = get_top_ngrams('german.txt', 3)
-    fr_bigram = get_top_ngrams('french.txt', 2)
-    fr_trigram = get_top_ngrams('french.txt', 3)
+    parser = argparse.ArgumentParser(description='Identify the language of a sentence with character n-grams.')
+    parser.add_argument('--profiles', default=PROFILES_DIR, help='directory of compiled language profiles')
+    parser.add_argument('--compile', action='store_true', help='rebuild the default profiles from the training texts')
+    parser.add_argument('--add', nargs=2, action='append', default=[], metavar=('CODE', 'TEXT_FILE'),
+                        help='compile the profile of another language from a utf-8 training text')
+    parser.add_argument('--eval', metavar='LABELLED_FILE',
+                        help='evaluate on a labelled file with a process pool and exit')
+    parser.add_argument('--jobs', type=int, default=None, help='number of processes for --eval')
+    parser.add_argument('--chunk-size', type=int, default=10000, help='lines per chunk for --eval')
+    parser.add_argument('--encoding', default='latin-1',
+                        help='encoding of the --eval file (sentences.txt is latin-1, generate_data.py writes utf-8)')
+    args = parser.parse_args()
+
+    if args.compile:
+        compile_profiles(args.profiles)
+    for lang, filename in args.add:
+        compile_profile(lang, filename, args.profiles)
+    if args.eval:
+        evaluate_parallel(args.eval, args.profiles, args.jobs, args.chunk_size, args.encoding)
+        return
+    index = NgramIndex(load_profiles(args.profiles))
+
+    test_accuracy('sentences.txt', index)
 
     while True:
         sentence = input("Enter a sentence (or 'exit' to quit): ").lower()
         if sentence == 'exit':
             break
 
-        sentence = re.sub(r'[^a-z]', '', sentence)  # remove non-alphabetic characters
-
-        en_score = calculate_score(sentence, en_bigram, 2) + calculate_score(sentence, en_trigram, 3)
-        de_score = calculate_score(sentence, de_bigram, 2) + calculate_score(sentence, de_trigram, 3)
-        fr_score = calculate_score(sentence, fr_bigram, 2) + calculate_score(sentence, fr_trigram, 3)
-
-        scores = {'English': en_score, 'German': de_score, 'French': fr_score}
-        detected_language = max(scores, key=scores.get)
+        detected_language, scores = detect_language(normalize(sentence), index)
+        scores = {LANGUAGE_NAMES.get(lang, lang): score for lang, score in scores.items()}
 
-        print(f"The detected language is: {detected_language}")
+        print(f"The detected language is: {LANGUAGE_NAMES.get(detected_language, detected_language)}")
         print(scores)
 
 if __name__ == "__main__":
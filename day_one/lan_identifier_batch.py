@@ -0,0 +1,127 @@
+# Vectorized language identification for large batches of sentences.
+# A batch is turned into one sparse matrix of hashed n-gram counts (sentences x features) and the
+# profiles into a 0/1 matrix (features x languages), so scoring the whole batch is one matrix product.
+# Run this file to benchmark it against the sentence by sentence loop of lan_identifier.py.
+
+import argparse
+import time
+from functools import lru_cache
+
+import numpy as np
+from scipy import sparse
+
+import lan_identifier as li
+
+N_FEATURES = 1 << 20    # size of the hashed n-gram space
+PRIME = 1000003
+
+def hash_ngrams(codes, n, n_features=N_FEATURES):
+    # Polynomial hash of every n-gram in an array of code points (uint64, overflow wraps around)
+    m = len(codes) - n + 1
+    if m <= 0:
+        return np.zeros(0, dtype=np.int64)
+    h = np.full(m, n, dtype=np.uint64)
+    for k in range(n):
+        h = h * np.uint64(PRIME) + codes[k:k + m]
+    return (h % np.uint64(n_features)).astype(np.int64)
+
+def to_codes(text):
+    return np.frombuffer(text.encode('utf-32-le'), dtype='<u4').astype(np.uint64)
+
+def ngram_matrix(sentences, sizes=li.NGRAM_SIZES, n_features=N_FEATURES):
+    # Count the hashed n-grams of every normalized sentence without a Python loop over characters:
+    # all sentences are concatenated and n-grams that cross a sentence boundary are masked out.
+    texts = [li.normalize(sentence) for sentence in sentences]
+    lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+    codes = to_codes(''.join(texts))
+    row_of_char = np.repeat(np.arange(len(texts)), lengths)
+    offset_in_row = np.arange(len(codes)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+    # One column per n-gram size, one row per start position: read row by row the valid hashes
+    # are already grouped by sentence, so the CSR arrays can be built without sorting
+    hashes = np.zeros((len(codes), len(sizes)), dtype=np.int64)
+    inside = np.zeros((len(codes), len(sizes)), dtype=bool)
+    for j, n in enumerate(sizes):
+        m = max(len(codes) - n + 1, 0)
+        hashes[:m, j] = hash_ngrams(codes, n, n_features)
+        inside[:m, j] = offset_in_row[:m] + n <= lengths[row_of_char[:m]]
+    indices = hashes[inside]
+    per_row = np.bincount(row_of_char, weights=inside.sum(axis=1), minlength=len(texts)).astype(np.int64)
+    indptr = np.concatenate(([0], np.cumsum(per_row)))
+    # Repeated n-grams of a sentence stay separate entries; every product with the matrix sums them
+    return sparse.csr_matrix((np.ones(len(indices), dtype=np.int32), indices, indptr),
+                             shape=(len(texts), n_features))
+
+def profile_matrix(profiles, n_features=N_FEATURES):
+    # 0/1 matrix of shape (n_features, languages) with a 1 for every hashed n-gram of a profile
+    rows, cols = [], []
+    for j, profile in enumerate(profiles.values()):
+        for n, ngrams in profile.items():
+            for ngram in ngrams:
+                rows.append(hash_ngrams(to_codes(ngram), n, n_features)[0])
+                cols.append(j)
+    matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)),
+                               shape=(n_features, len(profiles)))
+    matrix.data[:] = 1  # n-grams of one language that share a bucket count once
+    return matrix
+
+class BatchIdentifier:
+    def __init__(self, profiles, n_features=N_FEATURES):
+        self.languages = np.array(list(profiles))
+        self.sizes = sorted({n for profile in profiles.values() for n in profile})
+        self.n_features = n_features
+        self.matrix = profile_matrix(profiles, n_features)
+
+    def identify_batch(self, sentences):
+        # Return the detected language of every sentence and the (sentences x languages) score array.
+        # Scores equal those of lan_identifier.detect_language up to (rare) hash collisions, and ties
+        # go to the first language just like max() over the score dict.
+        counts = ngram_matrix(sentences, self.sizes, self.n_features)
+        scores = (counts @ self.matrix).toarray()
+        return self.languages[scores.argmax(axis=1)], scores
+
+@lru_cache(maxsize=None)
+def get_identifier(profiles_dir=li.PROFILES_DIR, n_features=N_FEATURES):
+    return BatchIdentifier(li.load_profiles(profiles_dir), n_features)
+
+def identify_batch(sentences, profiles_dir=li.PROFILES_DIR):
+    return get_identifier(profiles_dir).identify_batch(sentences)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark batch language identification against the per-sentence loop.')
+    parser.add_argument('--data', default='sentences.txt', help='labelled sentences, replicated to --lines')
+    parser.add_argument('--lines', type=int, default=1_000_000)
+    parser.add_argument('--batch-size', type=int, default=50_000)
+    parser.add_argument('--loop-lines', type=int, default=100_000,
+                        help='the loop is only timed on this many lines to keep the benchmark short')
+    args = parser.parse_args()
+
+    with open(args.data, 'r', encoding='latin-1') as f:
+        base = [line.strip().rsplit(',', 1)[0] for line in f if line.strip()]
+    sentences = (base * (args.lines // len(base) + 1))[:args.lines]
+
+    profiles = li.load_profiles()
+    identifier = BatchIdentifier(profiles)
+    index = li.NgramIndex(profiles)
+
+    loop_sentences = sentences[:args.loop_lines]
+    start = time.perf_counter()
+    loop_labels = [li.detect_language(li.normalize(s), index)[0] for s in loop_sentences]
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    labels = []
+    for i in range(0, len(sentences), args.batch_size):
+        batch_labels, _ = identifier.identify_batch(sentences[i:i + args.batch_size])
+        labels.extend(batch_labels)
+    batch_time = time.perf_counter() - start
+
+    agreement = np.mean(np.array(labels[:len(loop_labels)]) == np.array(loop_labels))
+    loop_rate = len(loop_sentences) / loop_time
+    batch_rate = len(sentences) / batch_time
+    print(f"Loop:  {len(loop_sentences):>10} sentences  {loop_rate:12,.0f} sentences/sec")
+    print(f"Batch: {len(sentences):>10} sentences  {batch_rate:12,.0f} sentences/sec")
+    print(f"Speedup: {batch_rate / loop_rate:.1f}x, label agreement with the loop: {agreement:.4f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+# Long-running HTTP server for the sentiment pipeline trained in sklearn_randomforest.py.
+# The pipeline is loaded once at startup. Concurrent requests are collected into micro-batches
+# (at most --max-batch texts, waiting at most --max-wait ms for the batch to fill up) and every
+# batch is classified with a single pipeline.predict call.
+#
+#   POST /predict  {"text": "..."} or {"texts": ["...", ...]}  ->  {"predictions": [...]}
+#   GET  /stats    request and batch counters, throughput and p50/p99 latency in ms
+
+import argparse
+import json
+import queue
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import joblib
+import numpy as np
+
+class MicroBatcher:
+    # Collects texts from many threads and classifies them in batches on one worker thread
+
+    def __init__(self, model, max_batch=64, max_wait=0.005, latency_window=10000):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=latency_window)   # seconds, of the most recent requests
+        self.received = 0
+        self.served = 0
+        self.batches = 0
+        self.started = time.perf_counter()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def predict(self, texts):
+        # Called from a request thread: queue the texts and wait for their predictions
+        start = time.perf_counter()
+        pending = [(text, threading.Event(), {}) for text in texts]
+        for item in pending:
+            self.requests.put(item)
+        results = []
+        for _, done, result in pending:
+            done.wait()
+            if 'error' in result:
+                raise result['error']
+            results.append(result['prediction'])
+        with self.lock:
+            self.received += 1
+            self.latencies.append(time.perf_counter() - start)
+        return results
+
+    def _run(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                predictions = self.model.predict([text for text, _, _ in batch])
+                for (_, _, result), prediction in zip(batch, predictions):
+                    result['prediction'] = _plain(prediction)
+            except Exception:
+                # Classify the texts one by one, so a text that fails does not fail the others of its batch
+                for text, _, result in batch:
+                    try:
+                        result['prediction'] = _plain(self.model.predict([text])[0])
+                    except Exception as error:  # report it to the waiting request, keep serving
+                        result['error'] = error
+            with self.lock:
+                self.served += len(batch)
+                self.batches += 1
+            for _, done, _ in batch:
+                done.set()
+
+    def stats(self):
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            received, served, batches = self.received, self.served, self.batches
+        elapsed = time.perf_counter() - self.started
+        return {
+            'texts': served,
+            'requests': received,
+            'batches': batches,
+            'mean_batch_size': served / batches if batches else 0.0,
+            'texts_per_sec': served / elapsed,
+            'p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else None,
+            'p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else None,
+        }
+
+def _plain(prediction):
+    # numpy scalars are not JSON serializable
+    return prediction.item() if hasattr(prediction, 'item') else prediction
+
+def parse_texts(body):
+    # The texts of a /predict request body; TypeError unless it is {"text": str} or {"texts": [str, ...]}
+    if not isinstance(body, dict):
+        raise TypeError('the request body must be a JSON object')
+    texts = body['texts'] if 'texts' in body else [body['text']]
+    if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+        raise TypeError('texts must be strings')
+    return texts
+
+class BatchingServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # the default of 5 refuses connections under concurrent load
+
+def make_handler(batcher):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/stats':
+                self._reply(200, batcher.stats())
+            else:
+                self._reply(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path != '/predict':
+                self._reply(404, {'error': 'not found'})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                texts = parse_texts(body)
+            except (ValueError, KeyError, TypeError):
+                self._reply(400, {'error': 'expected {"text": "..."} or {"texts": [...]}'})
+                return
+            try:
+                self._reply(200, {'predictions': batcher.predict(texts)})
+            except Exception as error:
+                self._reply(500, {'error': str(error)})
+
+        def log_message(self, format, *args):
+            pass  # one line per request would dominate the output under load
+
+    return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the sentiment pipeline over HTTP with micro-batching.')
+    parser.add_argument('--model', default='text_classification_pipeline.pkl')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-batch', type=int, default=64, help='largest number of texts per predict call')
+    parser.add_argument('--max-wait', type=float, default=5.0, help='ms to wait for a batch to fill up')
+    args = parser.parse_args()
+
+    pipeline = joblib.load(args.model)
+    batcher = MicroBatcher(pipeline, args.max_batch, args.max_wait / 1000)
+    server = BatchingServer((args.host, args.port), make_handler(batcher))
+    print(f"Serving {args.model} on http://{args.host}:{args.port} (POST /predict, GET /stats)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nExiting...")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#Out-of-core version of sklearn_randomforest.py for review datasets that do not fit into memory.
+#The reviews are read from a JSON Lines file (one {"text": ..., "label": ...} object per line) in chunks.
+#Every chunk is vectorized with a HashingVectorizer, which is stateless (there is no vocabulary to fit),
+#and fed to an SGDClassifier with partial_fit. Memory therefore depends on the chunk size, not on the data size.
+#Every --test-every-th row of every chunk is held out and evaluated in a second pass over the file, so the
+#test set is drawn from the whole file however few chunks it has.
+#With --compare the TfidfVectorizer + RandomForestClassifier path of sklearn_randomforest.py is trained on the
+#same file as well, and rows/sec and peak memory of both are printed. Each path runs in a fresh process so
+#that the peak memory figures do not mix.
+
+import argparse
+import json
+import multiprocessing
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+from sklearn.linear_model import SGDClassifier
+from sklearn.pipeline import Pipeline
+
+from evaluation import ConfusionMatrix, peak_memory_mb
+
+CLASSES = ['negative', 'positive']
+
+def convert_to_jsonl(json_file, jsonl_file):
+    # One-off conversion of train_data.json (a single JSON array) to JSON Lines. This loads the array once.
+    with open(json_file, 'r') as f:
+        data = json.load(f)
+    with open(jsonl_file, 'w') as f:
+        for row in data:
+            f.write(json.dumps(row) + '\n')
+
+def read_chunks(filename, chunk_size, test_every, test):
+    # Yield the training rows (test=False) or the held-out rows (test=True) of every chunk of a JSON Lines file.
+    # Row n of the file is held out when n % test_every == test_every - 1.
+    first_row = 0
+    for chunk in pd.read_json(filename, lines=True, chunksize=chunk_size):
+        held_out = (np.arange(first_row, first_row + len(chunk)) % test_every) == test_every - 1
+        first_row += len(chunk)
+        rows = chunk[held_out == test]
+        if len(rows):
+            yield rows
+
+def train_out_of_core(filename, chunk_size=10000, test_every=10, n_features=2 ** 20, classes=CLASSES):
+    if test_every < 2:
+        raise ValueError(f'test_every must be at least 2 to leave rows for training, got {test_every}')
+    vectorizer = HashingVectorizer(stop_words='english', alternate_sign=False, n_features=n_features)
+    clf = SGDClassifier(loss='log_loss', random_state=42)
+
+    rows = 0
+    start = time.perf_counter()
+    for chunk in read_chunks(filename, chunk_size, test_every, test=False):
+        clf.partial_fit(vectorizer.transform(chunk['text']), chunk['label'], classes=classes)
+        rows += len(chunk)
+    train_time = time.perf_counter() - start
+    if not rows:
+        raise ValueError(f'no training rows in {filename}')
+
+    pipeline = Pipeline([('hashing', vectorizer), ('clf', clf)])
+    evaluation = ConfusionMatrix(classes)
+    for chunk in read_chunks(filename, chunk_size, test_every, test=True):
+        evaluation.update_labels(chunk['label'], pipeline.predict(chunk['text']))
+    if not evaluation.total():
+        raise ValueError(f'no held-out rows in {filename}: it has fewer than {test_every} rows')
+    return pipeline, evaluation, rows, train_time
+
+def train_in_memory(filename, sample=4400, test_size=400):
+    # The path of sklearn_randomforest.py: load everything, sample, fit TF-IDF and a random forest
+    from sklearn.model_selection import train_test_split
+
+    start = time.perf_counter()
+    data = pd.read_json(filename, lines=True)
+    if sample and sample < len(data):
+        data = data.sample(sample, random_state=42)
+    X_train, X_test, y_train, y_test = train_test_split(data['text'], data['label'], test_size=test_size, random_state=42)
+    pipeline = Pipeline([
+        ('tfidf', TfidfVectorizer(stop_words='english')),
+        ('clf', RandomForestClassifier(n_estimators=100, random_state=42))
+    ])
+    pipeline.fit(X_train, y_train)
+    train_time = time.perf_counter() - start
+
+    evaluation = ConfusionMatrix().update_labels(y_test, pipeline.predict(X_test))
+    return pipeline, evaluation, len(X_train), train_time
+
+def run(path, args):
+    # Train one path in this process and return its figures
+    if path == 'out-of-core':
+        pipeline, evaluation, rows, train_time = train_out_of_core(args.data, args.chunk_size, args.test_every)
+        joblib.dump(pipeline, args.model)
+    else:
+        pipeline, evaluation, rows, train_time = train_in_memory(args.data, args.compare_sample)
+    peak, _ = peak_memory_mb()
+    return {'path': path, 'rows': rows, 'rows_per_sec': rows / train_time,
+            'accuracy': evaluation.accuracy(), 'peak_mb': peak}
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the sentiment classifier out of core with partial_fit.')
+    parser.add_argument('--data', default='train_data.jsonl', help='JSON Lines file of {"text", "label"} objects')
+    parser.add_argument('--convert', metavar='JSON_FILE', help='first convert a JSON array file like train_data.json to --data')
+    parser.add_argument('--chunk-size', type=int, default=10000, help='rows read and vectorized at a time')
+    parser.add_argument('--test-every', type=int, default=10, help='hold out every n-th row for evaluation')
+    parser.add_argument('--model', default='streaming_pipeline.pkl', help='where to save the trained pipeline')
+    parser.add_argument('--compare', action='store_true', help='also run the TF-IDF + random forest path')
+    parser.add_argument('--compare-sample', type=int, default=4400, help='rows sampled by the random forest path, 0 for all')
+    args = parser.parse_args()
+
+    if args.convert:
+        convert_to_jsonl(args.convert, args.data)
+
+    paths = ['out-of-core'] + (['tfidf + random forest'] if args.compare else [])
+    context = multiprocessing.get_context('spawn')
+    for path in paths:
+        with context.Pool(1) as pool:
+            result = pool.apply(run, (path, args))
+        peak = f"{result['peak_mb']:.0f} MB" if result['peak_mb'] is not None else 'n/a'
+        print(f"{result['path']:>22}: {result['rows']:>9} training rows, {result['rows_per_sec']:10,.0f} rows/sec, "
+              f"peak RSS {peak}, accuracy {result['accuracy']:.3f}")
+
+if __name__ == "__main__":
+    main()
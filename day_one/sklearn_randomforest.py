@@ -5,9 +5,11 @@ import pandas as pd
 from sklearn.model_selection import train_test_split
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.metrics import accuracy_score, classification_report
+from evaluation import ConfusionMatrix
 from sklearn.pipeline import Pipeline
 import joblib
+from feature_cache import CachedVectorizer
+from compact_model import export_compact
 
 
 #The dataset is the IBDM reviews of movies. It is available for free on https://www.kaggle.com/datasets/lakshmi25npathi/imdb-dataset-of-50k-movie-reviews 
@@ -17,6 +19,7 @@ with open('train_data.json', 'r') as file:
     data = pd.read_json(file)
 
 # Use only 4400 examples (4000 for training and 400 for testing)
+# To train on the full dataset without loading it into memory see sklearn_out_of_core.py
 data = data.sample(4400, random_state=42)
 
 # Split data into training and testing sets
@@ -27,7 +30,9 @@ X_train, X_test, y_train, y_test = train_test_split(data['text'], data['label'],
 #from sklearn.feature_extraction.text import CountVectorizer
 #from sklearn.feature_extraction.text import HashingVectorize
 # Convert text data into numerical vectors using TF-IDF
-vectorizer = TfidfVectorizer(stop_words='english')
+# CachedVectorizer stores the fitted vectorizer and the matrices on disk (in feature_cache/), keyed by the texts and
+# the vectorizer parameters, so reruns on the same data and the pipeline below do not fit TF-IDF again
+vectorizer = CachedVectorizer(TfidfVectorizer(stop_words='english'))
 X_train_vec = vectorizer.fit_transform(X_train)
 X_test_vec = vectorizer.transform(X_test)
 
@@ -39,12 +44,15 @@ clf.fit(X_train_vec, y_train)
 y_pred = clf.predict(X_test_vec)
 
 # Evaluate the model
-print("Accuracy:", accuracy_score(y_test, y_pred))
-print("\nClassification Report:\n", classification_report(y_test, y_pred))
+evaluation = ConfusionMatrix().update_labels(y_test, y_pred)
+print("Accuracy:", evaluation.accuracy())
+print("\nClassification Report:\n", evaluation.report())
 
 # Save the trained model and vectorizer
 joblib.dump(clf, 'random_forest_model.pkl')
-joblib.dump(vectorizer, 'tfidf_vectorizer.pkl')
+joblib.dump(vectorizer.vectorizer_, 'tfidf_vectorizer.pkl')
+# The same model as flat arrays, which load much faster (load it with compact_model.load_compact('compact_model'))
+export_compact(vectorizer.vectorizer_, clf, 'compact_model')
 
 # Load the saved model and vectorizer
 clf = joblib.load('random_forest_model.pkl')
@@ -62,7 +70,7 @@ while True:
 #Let's try the same procedure but with using pipeline
 # Create a pipeline with a TfidfVectorizer and RandomForestClassifier
 pipeline = Pipeline([
-    ('tfidf', TfidfVectorizer(stop_words='english')),
+    ('tfidf', CachedVectorizer(TfidfVectorizer(stop_words='english'))),
     ('clf', RandomForestClassifier(n_estimators=100, random_state=42))
 ])
 
@@ -73,11 +81,14 @@ pipeline.fit(X_train, y_train)
 y_pred = pipeline.predict(X_test)
 
 # Evaluate the model
-print("Accuracy:", accuracy_score(y_test, y_pred))
-print("\nClassification Report:\n", classification_report(y_test, y_pred))
-
-# Save the trained pipeline
-joblib.dump(pipeline, 'text_classification_pipeline.pkl')
+evaluation = ConfusionMatrix().update_labels(y_test, y_pred)
+print("Accuracy:", evaluation.accuracy())
+print("\nClassification Report:\n", evaluation.report())
+
+# Save the trained pipeline with the plain fitted TfidfVectorizer: the disk cache is for training runs, the servers
+# that load this pipeline (sentiment_server.py, the MCP server) should not hash and store the texts they classify
+joblib.dump(Pipeline([('tfidf', pipeline.named_steps['tfidf'].vectorizer_), ('clf', pipeline.named_steps['clf'])]),
+            'text_classification_pipeline.pkl')
 
 # Load the saved pipeline
 pipeline = joblib.load('text_classification_pipeline.pkl')
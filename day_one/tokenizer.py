@@ -1,4 +1,16 @@
+import argparse
+import io
+import os
 import string
+from multiprocessing import Pool
+
+# The two rules of tokenize_text work character by character: every punctuation
+# mark becomes a space followed by the mark, and every space becomes a new line.
+# This table applies both rules in a single str.translate pass.
+TOKEN_TABLE = str.maketrans({**{punct: f'\n{punct}' for punct in string.punctuation}, ' ': '\n'})
+
+CHUNK_SIZE = 1 << 20        # characters read per step by tokenize_stream
+SHARD_SIZE = 64 << 20       # bytes per shard in parallel mode
 
 def tokenize_text(text):
     # Rule 1: Replace every punctuation with whitespace then the punctuation
@@ -10,16 +22,84 @@ def tokenize_text(text):
     
     return text
 
+def tokenize_stream(file, chunk_size=CHUNK_SIZE):
+    # Yield the tokens of an open text file one by one, reading it in fixed size chunks.
+    # '\n'.join(tokenize_stream(f)) is identical to tokenize_text(f.read()), but only one
+    # chunk and the token that crosses its boundary are kept in memory.
+    pending = ''
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        tokens = (pending + chunk.translate(TOKEN_TABLE)).split('\n')
+        pending = tokens.pop()  # may continue in the next chunk
+        yield from tokens
+    yield pending
+
+def find_shards(filename, shard_size=SHARD_SIZE):
+    # Split a file into (start, end) byte ranges that end right after a new line,
+    # so that no character or line ending is cut in two.
+    size = os.path.getsize(filename)
+    shards = []
+    with open(filename, 'rb') as f:
+        start = 0
+        while start < size:
+            f.seek(min(start + shard_size, size))
+            f.readline()
+            end = min(f.tell(), size)
+            shards.append((start, end))
+            start = end
+    return shards
+
+def tokenize_shard(args):
+    filename, start, end, encoding = args
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    # Decode like open(filename, 'r') would: same encoding and universal new lines
+    text = io.TextIOWrapper(io.BytesIO(data), encoding=encoding).read()
+    return text.translate(TOKEN_TABLE)
+
+def tokenize_file_parallel(input_file, output_file, jobs=None, shard_size=SHARD_SIZE, encoding=None):
+    # Tokenize the shards of a large file on all cores and write them back in order
+    shards = [(input_file, start, end, encoding) for start, end in find_shards(input_file, shard_size)]
+    with Pool(jobs) as pool, open(output_file, 'w', encoding=encoding) as out:
+        for tokenized in pool.imap(tokenize_shard, shards):
+            out.write(tokenized)
+
 def main():
+    parser = argparse.ArgumentParser(description='Split a text file into one token per line.')
+    parser.add_argument('input', nargs='?', default='english.txt')
+    parser.add_argument('output', nargs='?', default='english_tokenized.txt')
+    parser.add_argument('--mode', choices=['text', 'stream', 'parallel'], default='text',
+                        help='text: read the whole file at once, stream: constant memory, '
+                             'parallel: tokenize shards of the file on all cores')
+    parser.add_argument('--jobs', type=int, default=None, help='number of processes in parallel mode')
+    parser.add_argument('--shard-size', type=int, default=SHARD_SIZE, help='bytes per shard in parallel mode')
+    args = parser.parse_args()
+
+    if args.mode == 'parallel':
+        tokenize_file_parallel(args.input, args.output, args.jobs, args.shard_size)
+        return
+
+    if args.mode == 'stream':
+        with open(args.input, 'r') as file, open(args.output, 'w') as out:
+            tokens = tokenize_stream(file)
+            out.write(next(tokens))
+            for token in tokens:
+                out.write('\n')
+                out.write(token)
+        return
+
     # Read the text from the file
-    with open('english.txt', 'r') as file:
+    with open(args.input, 'r') as file:
         text = file.read()
     
     # Tokenize the text
     tokenized_text = tokenize_text(text)
     
     # Write the tokenized text to a new file
-    with open('english_tokenized.txt', 'w') as file:
+    with open(args.output, 'w') as file:
         file.write(tokenized_text)
 
 if __name__ == "__main__":
@@ -1,31 +1,138 @@
+import argparse
+import time
+from collections import defaultdict
+from itertools import islice
+
 import spacy
+from spacy.scorer import PRFScore
 from spacy.tokens import DocBin
 from spacy.training import Example
+from spacy.util import minibatch
+
+from day_one.evaluation import peak_memory_mb
+
+
+def predict_timed(nlp, gold_docs, batch_size, timings):
+    # Run the pipeline batch by batch and component by component in this process,
+    # adding the time spent in every component to timings
+    for batch in minibatch(gold_docs, size=batch_size):
+        start = time.perf_counter()
+        docs = [nlp.make_doc(gold_doc.text) for gold_doc in batch]
+        timings['tokenizer'] += time.perf_counter() - start
+        for name, component in nlp.pipeline:
+            start = time.perf_counter()
+            if hasattr(component, 'pipe'):
+                docs = list(component.pipe(docs, batch_size=batch_size))
+            else:
+                docs = [component(doc) for doc in docs]
+            timings[name] += time.perf_counter() - start
+        yield from zip(docs, batch)
+
+
+def predict_parallel(nlp, gold_docs, batch_size, n_process):
+    # nlp.pipe over n_process processes, keeping every prediction paired with its gold doc
+    texts = ((gold_doc.text, gold_doc) for gold_doc in gold_docs)
+    return nlp.pipe(texts, as_tuples=True, batch_size=batch_size, n_process=n_process)
+
+
+class StreamingScores:
+    # The scores printed below, counted one Example at a time so that no predicted or gold doc is kept.
+    # The counts are those of spaCy's Scorer.score_tokenization (token_acc) and spacy.scorer.get_ner_prf (ents_*)
+
+    def __init__(self):
+        self.tokens = PRFScore()
+        self.ents = PRFScore()
+        self.docs = 0
+
+    def add(self, example):
+        self.docs += 1
+        align_x2y = example.alignment.x2y
+        if not example.reference.has_unknown_spaces:
+            for token in example.predicted:
+                if not token.orth_.isspace():
+                    if align_x2y.lengths[token.i] != 1:
+                        self.tokens.fp += 1
+                    else:
+                        self.tokens.tp += 1
+        if example.reference.has_annotation("ENT_IOB"):
+            golds = {(ent.label_, ent.start, ent.end) for ent in example.reference.ents}
+            for pred_ent in example.predicted.ents:
+                indices = align_x2y[pred_ent.start:pred_ent.end]
+                if not len(indices):
+                    continue
+                # A prediction on tokens without gold entity annotation is neither right nor wrong
+                if all(token.ent_iob != 0 for token in example.reference[indices[0]:indices[-1] + 1]):
+                    key = (pred_ent.label_, indices[0], indices[-1] + 1)
+                    if key in golds:
+                        self.ents.tp += 1
+                        golds.remove(key)
+                    else:
+                        self.ents.fp += 1
+            self.ents.fn += len(golds)
+
+    def scores(self):
+        ents = len(self.ents) > 0
+        return {'token_acc': self.tokens.precision if len(self.tokens) else None,
+                'ents_p': self.ents.precision if ents else None,
+                'ents_r': self.ents.recall if ents else None,
+                'ents_f': self.ents.fscore if ents else None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate a spaCy pipeline on a DocBin of gold documents.')
+    parser.add_argument('--model', default="path/to/model") # replace with actual path to model
+    parser.add_argument('--data', default="path/to/dev.spacy") # replace with actual path to dev
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--n-process', type=int, default=1)
+    parser.add_argument('--profile-docs', type=int, default=500,
+                        help='with --n-process > 1, time the components on this many docs in the main process')
+    args = parser.parse_args()
+
+    #load the model
+    nlp = spacy.load(args.model)
 
-#load the model
-nlp = spacy.load("path/to/model") # replace with actual path to model
+    #load the evaluation data. The gold docs are streamed out of the DocBin, not put into a list
+    doc_bin = DocBin().from_disk(args.data)
+    eval_docs = doc_bin.get_docs(nlp.vocab)
 
-#load the evaluation data
-eval_data_file = "path/to/dev.spacy" # replace with actual path to dev
-doc_bin = DocBin().from_disk(eval_data_file)
-eval_docs = list(doc_bin.get_docs(nlp.vocab))
+    #Predict in batches and score every Example as its prediction comes out of the pipeline, so memory does not
+    #grow with the size of the dev set; nlp.evaluate would also run the whole pipeline a second time
+    timings = defaultdict(float)
+    start = time.perf_counter()
+    if args.n_process > 1:
+        predictions = predict_parallel(nlp, eval_docs, args.batch_size, args.n_process)
+    else:
+        predictions = predict_timed(nlp, eval_docs, args.batch_size, timings)
+    counts = StreamingScores()
+    for pred_doc, gold_doc in predictions:
+        counts.add(Example(pred_doc, gold_doc))
+    elapsed = time.perf_counter() - start
+    scores = counts.scores()
 
 
-#Prepare the evaluation data as a list of Example objects
-examples = []
+    print("Token-level scores:", scores["token_acc"])
+    print("Entity-level scores:")
+    print(" - Precision:", scores["ents_p"])
+    print(" - Recall:", scores["ents_r"])
+    print(" - F1-score:", scores["ents_f"])
 
-for gold_doc in eval_docs:
-    text = gold_doc.text
-    pred_doc = nlp(text)
-    example = Example(gold_doc, pred_doc)
-    examples.append(example)
+    print(f"\nDocs/sec: {counts.docs / elapsed:,.1f} ({counts.docs} docs in {elapsed:.2f}s, "
+          f"batch size {args.batch_size}, {args.n_process} process(es))")
 
+    profiled = counts.docs
+    if args.n_process > 1:
+        profiled_docs = islice(DocBin().from_disk(args.data).get_docs(nlp.vocab), args.profile_docs)
+        profiled = sum(1 for _ in predict_timed(nlp, profiled_docs, args.batch_size, timings))
+    total = sum(timings.values())
+    print(f"Time per pipeline component ({profiled} docs, one process):")
+    for name, seconds in timings.items():
+        share = seconds / total if total else 0.0
+        print(f" - {name}: {seconds:.2f}s ({share:.0%}, {seconds / max(profiled, 1) * 1000:.2f} ms/doc)")
 
-scores = nlp.evaluate(examples)
+    own, children = peak_memory_mb()
+    if own is not None:
+        print(f"Peak memory: {own:.1f} MB main process, {children:.1f} MB largest worker")
 
 
-print("Token-level scores:", scores["token_acc"])
-print("Entity-level scores:")
-print(" - Precision:", scores["ents_p"])
-print(" - Recall:", scores["ents_r"])
-print(" - F1-score:", scores["ents_f"])
\ No newline at end of file
+if __name__ == "__main__":
+    main()